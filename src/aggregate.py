@@ -0,0 +1,276 @@
+import math, array
+import numpy as np
+
+DEFAULT_BIN_SIZE = 900.0
+DEFAULT_VOLUME_BIN_SIZE = 3600.0
+
+# Entered links are buffered and counted into the volume matrix in batches of this size
+VOLUME_BATCH_SIZE = 65536
+
+# Quantiles of the sketch are within 1% of the true travel time; shorter times than MIN_VALUE count as MIN_VALUE
+RELATIVE_ACCURACY = 0.01
+GAMMA = (1.0 + RELATIVE_ACCURACY) / (1.0 - RELATIVE_ACCURACY)
+LOG_GAMMA = math.log(GAMMA)
+MIN_VALUE = 0.01
+
+QUANTILES = (0.5, 0.9, 0.95)
+
+def bucket_value(index):
+    return 2.0 * GAMMA ** index / (GAMMA + 1.0)
+
+def quantile(sketch, count, q):
+    """ Estimates a quantile from a sketch, a dict of log-bucket index to count. """
+    rank = q * (count - 1)
+    cumulative = 0
+
+    for index in sorted(sketch):
+        cumulative += sketch[index]
+        if cumulative > rank: return bucket_value(index)
+
+    return None
+
+def merge_sketches(target, sketch):
+    for index, count in sketch.items():
+        target[index] = target.get(index, 0) + count
+
+def encode_sketch(sketch):
+    return array.array('q', [value for item in sorted(sketch.items()) for value in item]).tobytes()
+
+def decode_sketch(data):
+    values = array.array('q')
+    values.frombytes(data)
+    return dict(zip(values[0::2], values[1::2]))
+
+class LinkStatistics:
+    """
+        Travel time statistics per link and time bin (by enter time), collected while reading instead of
+        scanning link_times afterwards: count, sum and sum of squares, and a log-bucket quantile sketch.
+        The sketch is stored with each row, so statistics of several runs or shards can be merged exactly.
+    """
+
+    FIELDS = ('link', 'bin', 'start_time', 'count', 'sum', 'sum_squares', 'mean', 'std', 'p50', 'p90', 'p95', 'sketch')
+    TYPES = ('text', 'integer', 'real', 'integer', 'real', 'real', 'real', 'real', 'real', 'real', 'real', 'blob')
+
+    def __init__(self, bin_size = DEFAULT_BIN_SIZE):
+        self.bin_size = bin_size
+        self.bins = {}
+
+    def add(self, link, enter_time, leave_time):
+        travel_time = leave_time - enter_time
+        key = (link, int(enter_time // self.bin_size))
+
+        entry = self.bins.get(key)
+
+        if entry is None:
+            entry = [0, 0.0, 0.0, {}]
+            self.bins[key] = entry
+
+        entry[0] += 1
+        entry[1] += travel_time
+        entry[2] += travel_time * travel_time
+
+        index = math.ceil(math.log(max(travel_time, MIN_VALUE)) / LOG_GAMMA)
+        sketch = entry[3]
+        sketch[index] = sketch.get(index, 0) + 1
+
+    def merge(self, other):
+        for key, (count, total, squares, sketch) in other.bins.items():
+            entry = self.bins.get(key)
+
+            if entry is None:
+                self.bins[key] = [count, total, squares, dict(sketch)]
+            else:
+                entry[0] += count
+                entry[1] += total
+                entry[2] += squares
+                merge_sketches(entry[3], sketch)
+
+    def rows(self):
+        for (link, bin), (count, total, squares, sketch) in self.bins.items():
+            mean = total / count
+            std = math.sqrt(max(0.0, squares / count - mean * mean))
+
+            yield (
+                (link, bin, bin * self.bin_size, count, total, squares, mean, std)
+                + tuple([quantile(sketch, count, q) for q in QUANTILES])
+                + (encode_sketch(sketch),))
+
+class LinkVolumes:
+    """
+        Counts of vehicles entering each link per mode and time bin, in a numpy matrix [link, mode, bin].
+        The link axis is indexed by interned link id - 1 (links.rowid - 1 if the network was read first, like
+        csr.Graph), modes are numbered in the order they appear. Events are buffered in flat arrays and added
+        to the matrix with np.add.at in batches, growing it when new links or bins show up.
+    """
+
+    FIELDS = ('link', 'mode', 'bin', 'start_time', 'count')
+    TYPES = ('text', 'text', 'integer', 'real', 'integer')
+
+    def __init__(self, link_ids, bin_size = DEFAULT_VOLUME_BIN_SIZE, batch_size = VOLUME_BATCH_SIZE):
+        self.link_ids = link_ids
+        self.bin_size = bin_size
+        self.batch_size = batch_size
+
+        self.mode_indices = {}
+        self.mode_names = []
+
+        self.counts = np.zeros((0, 0, 0), dtype = np.int32)
+        self.link_count = 0
+        self.bin_count = 0
+
+        self.links = array.array('q')
+        self.modes = array.array('q')
+        self.bins = array.array('q')
+
+    def add(self, link, mode, time):
+        index = self.mode_indices.get(mode)
+
+        if index is None:
+            index = len(self.mode_names)
+            self.mode_indices[mode] = index
+            self.mode_names.append(mode)
+
+        self.links.append(self.link_ids(link) - 1)
+        self.modes.append(index)
+        self.bins.append(int(time // self.bin_size))
+
+        if len(self.links) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if len(self.links) == 0: return
+
+        links = np.frombuffer(self.links, dtype = np.int64)
+        modes = np.frombuffer(self.modes, dtype = np.int64)
+        bins = np.frombuffer(self.bins, dtype = np.int64)
+
+        self.link_count = max(self.link_count, int(links.max()) + 1)
+        self.bin_count = max(self.bin_count, int(bins.max()) + 1)
+
+        shape = self.counts.shape
+        needed = (self.link_count, len(self.mode_names), self.bin_count)
+
+        if needed[0] > shape[0] or needed[1] > shape[1] or needed[2] > shape[2]:
+            # Capacity doubles, so growing the matrix costs amortized constant time per link or bin
+            counts = np.zeros((
+                max(needed[0], 2 * shape[0]), max(needed[1], shape[1]), max(needed[2], 2 * shape[2])), dtype = self.counts.dtype)
+            counts[:shape[0], :shape[1], :shape[2]] = self.counts
+            self.counts = counts
+
+        np.add.at(self.counts, (links, modes, bins), 1)
+
+        del links, modes, bins
+        del self.links[:], self.modes[:], self.bins[:]
+
+    def matrix(self):
+        """ The counts as an int32 array [link, mode, bin]. """
+        self.flush()
+        return self.counts[:self.link_count, :len(self.mode_names), :self.bin_count]
+
+    def rows(self):
+        """ Yields (link id, mode, bin, start time, count) of every non-zero count. """
+        matrix = self.matrix()
+
+        for link, mode, bin in zip(*np.nonzero(matrix)):
+            yield int(link) + 1, self.mode_names[mode], int(bin), bin * self.bin_size, int(matrix[link, mode, bin])
+
+class ServiceStatistics:
+    """
+        Running aggregates of the services of a DRT / AV fleet: totals per driver, and per time bin the
+        services started, their mean wait time and the fleet occupancy. Occupancy comes from a sweep over the
+        start and end times of all services (busy vehicles) and their pickups and dropoffs (vehicles with a
+        passenger), done with numpy once all services are read. Utilization is the share of the fleet that is
+        busy, so it needs the fleet size: drivers without services do not show up in the services file.
+    """
+
+    DRIVER_FIELDS = ('driver', 'services', 'busy_time', 'occupied_time', 'mean_wait_time', 'pickup_distance', 'dropoff_distance', 'empty_distance_ratio')
+    DRIVER_TYPES = ('text', 'integer', 'real', 'real', 'real', 'real', 'real', 'real')
+
+    BIN_FIELDS = ('bin', 'start_time', 'services', 'mean_wait_time', 'busy_vehicles', 'occupied_vehicles', 'max_busy_vehicles', 'utilization')
+    BIN_TYPES = ('integer', 'real', 'integer', 'real', 'real', 'real', 'integer', 'real')
+
+    def __init__(self, bin_size = DEFAULT_BIN_SIZE, fleet_size = None):
+        self.bin_size = bin_size
+        self.fleet_size = fleet_size
+        self.drivers = {}
+
+        self.starts = array.array('d')
+        self.ends = array.array('d')
+        self.pickups = array.array('d')
+        self.dropoffs = array.array('d')
+        self.wait_times = array.array('d')
+
+    def add(self, driver, start_time, end_time, pickup_time, dropoff_time, wait_time, pickup_distance, dropoff_distance):
+        entry = self.drivers.get(driver)
+
+        if entry is None:
+            entry = [0, 0.0, 0.0, 0.0, 0.0, 0.0]
+            self.drivers[driver] = entry
+
+        entry[0] += 1
+        entry[1] += end_time - start_time
+        entry[2] += dropoff_time - pickup_time
+        entry[3] += wait_time
+        entry[4] += pickup_distance
+        entry[5] += dropoff_distance
+
+        self.starts.append(start_time)
+        self.ends.append(end_time)
+        self.pickups.append(pickup_time)
+        self.dropoffs.append(dropoff_time)
+        self.wait_times.append(wait_time)
+
+    def driver_rows(self):
+        for driver, (services, busy_time, occupied_time, wait_time, pickup_distance, dropoff_distance) in self.drivers.items():
+            distance = pickup_distance + dropoff_distance
+
+            yield (
+                driver, services, busy_time, occupied_time, wait_time / services, pickup_distance, dropoff_distance,
+                pickup_distance / distance if distance > 0.0 else None)
+
+    def occupancy(self, starts, ends, bin_count):
+        """ Returns the mean and maximum number of open intervals [start, end) per time bin. """
+        boundaries = np.arange(bin_count + 1) * self.bin_size
+
+        # Bin boundaries are added as breakpoints, so that every piece of the step function lies in one bin
+        times = np.concatenate([starts, ends, boundaries])
+        changes = np.concatenate([np.ones(len(starts)), -np.ones(len(ends)), np.zeros(len(boundaries))])
+
+        # Intervals ending at a time are closed before those starting at it are opened
+        order = np.lexsort((changes, times))
+        times, changes = times[order], changes[order]
+
+        open_intervals = np.cumsum(changes)
+        durations = np.diff(times)
+        bins = np.clip((times[:-1] // self.bin_size).astype(np.int64), 0, bin_count - 1)
+
+        mean = np.bincount(bins, weights = open_intervals[:-1] * durations, minlength = bin_count) / self.bin_size
+
+        maximum = np.zeros(bin_count)
+        np.maximum.at(maximum, bins, open_intervals[:-1])
+
+        return mean, maximum
+
+    def bin_rows(self):
+        if len(self.starts) == 0: return
+
+        starts = np.frombuffer(self.starts, dtype = np.float64)
+        ends = np.frombuffer(self.ends, dtype = np.float64)
+        pickups = np.frombuffer(self.pickups, dtype = np.float64)
+        dropoffs = np.frombuffer(self.dropoffs, dtype = np.float64)
+        wait_times = np.frombuffer(self.wait_times, dtype = np.float64)
+
+        bin_count = int(max(ends.max(), dropoffs.max()) // self.bin_size) + 1
+
+        start_bins = (starts // self.bin_size).astype(np.int64)
+        services = np.bincount(start_bins, minlength = bin_count)
+        wait_sums = np.bincount(start_bins, weights = wait_times, minlength = bin_count)
+
+        busy, max_busy = self.occupancy(starts, ends, bin_count)
+        occupied, max_occupied = self.occupancy(pickups, dropoffs, bin_count)
+
+        for bin in range(bin_count):
+            yield (
+                bin, bin * self.bin_size, int(services[bin]), wait_sums[bin] / services[bin] if services[bin] > 0 else None,
+                float(busy[bin]), float(occupied[bin]), int(max_busy[bin]),
+                float(busy[bin]) / self.fleet_size if self.fleet_size else None)
@@ -0,0 +1,174 @@
+import gzip
+import pathlib
+import sys, os, re, shutil
+import time
+import concurrent.futures
+
+import options
+import engine, database, plans_filter
+from writer import DEFAULT_BATCH_SIZE, make_create_query
+
+import ingest_events
+from read_distances import DistancesReader
+from read_services import ServiceReader
+
+KINDS = ('events', 'distances', 'services')
+
+# Files of iteration N in ITERS/it.N, by the kind of reader they are ingested with
+PATTERNS = {
+    'events' : re.compile(r'^(\d+)\.events\.xml\.gz$'),
+    'distances' : re.compile(r'^(\d+)\.plans\.xml(\.gz)?$'),
+    'services' : re.compile(r'^(\d+)\..*services.*\.xml\.gz$'),
+}
+
+def find_sources(directory, kinds):
+    """ Returns (kind, path, iteration) of the files in ITERS/it.*, ordered by iteration. """
+    sources = []
+
+    for path in (pathlib.Path(directory) / 'ITERS').iterdir():
+        if not path.name.startswith('it.'): continue
+        iteration = int(path.name.split('.')[1])
+
+        for name in sorted(os.listdir(str(path))):
+            for kind in kinds:
+                match = PATTERNS[kind].match(name)
+
+                if match is not None and int(match.group(1)) == iteration:
+                    sources.append((kind, str(path / name), iteration))
+
+    return sorted(sources, key = lambda source: (source[2], KINDS.index(source[0])))
+
+def open_source(kind, source):
+    if kind == 'distances':
+        return plans_filter.open_plans(source)
+
+    return gzip.open(source) if source.endswith('.gz') else open(source, 'rb')
+
+def ingest(kind, source, shard_database, suffix, sinks, batch_size, parser):
+    """ Reads one file into the final tables (e.g. events_<suffix>) of its own shard database, returns the table names. """
+    # Shard databases are scratch files, so they are always bulk loaded (and left overs replaced)
+    if os.path.exists(shard_database):
+        os.remove(shard_database)
+
+    connection = database.connect(shard_database, 'bulk')
+    cursor = connection.cursor()
+
+    if kind == 'events':
+        ingest_events.create_tables(cursor, sinks, suffix)
+        reader = ingest_events.make_dispatcher(cursor, sinks, batch_size)
+
+        for sink_reader in reader.readers.values():
+            sink_reader.display = float('inf')
+    elif kind == 'distances':
+        cursor.execute(make_create_query('_distances', DistancesReader.FIELDS, DistancesReader.TYPES))
+        reader = DistancesReader(cursor, batch_size)
+    else:
+        for table, fields, types in ServiceReader.TABLES:
+            cursor.execute(make_create_query('_%s' % table, fields, types))
+
+        reader = ServiceReader(cursor, batch_size)
+
+    reader.display = float('inf')
+
+    with open_source(kind, source) as f:
+        engine.parse(f, reader, parser)
+
+    connection.commit()
+
+    if kind == 'events':
+        ingest_events.rename_tables(cursor, sinks, suffix)
+        tables = ingest_events.table_names(sinks, suffix)
+    elif kind == 'distances':
+        cursor.execute('alter table _distances rename to distances_%s' % suffix)
+        tables = ['distances_%s' % suffix]
+    else:
+        tables = []
+
+        for table, fields, types in ServiceReader.TABLES:
+            cursor.execute('alter table _%s rename to %s_%s' % (table, table, suffix))
+            tables.append('%s_%s' % (table, suffix))
+
+    connection.commit()
+    connection.close()
+
+    return shard_database, tables, reader.count
+
+def merge(connection, shard_database, tables):
+    """ Copies tables with their indexes from a shard database, replacing tables of the same name. """
+    cursor = connection.cursor()
+    cursor.execute('attach database ? as shard', (shard_database,))
+
+    for table in tables:
+        cursor.execute('drop table if exists main.%s' % table)
+
+        cursor.execute('select type, sql from shard.sqlite_master where tbl_name = ? and sql is not null order by type = \'index\'', (table,))
+
+        for type, sql in cursor.fetchall():
+            cursor.execute(sql)
+
+            if type == 'table':
+                cursor.execute('insert into main.%s select * from shard.%s' % (table, table))
+
+    connection.commit()
+    cursor.execute('detach database shard')
+
+if __name__ == '__main__':
+    batch_size = options.pop_option(sys.argv, '--batch-size', DEFAULT_BATCH_SIZE, int)
+    parser = options.pop_option(sys.argv, '--parser', engine.DEFAULT_BACKEND)
+    profile = options.pop_option(sys.argv, '--profile', database.DEFAULT_PROFILE)
+    workers = options.pop_option(sys.argv, '--workers', os.cpu_count() or 1, int)
+    kinds = options.pop_option(sys.argv, '--kinds', ','.join(KINDS)).split(',')
+    sinks = options.pop_option(sys.argv, '--sinks', 'events,link_times').split(',')
+
+    if len(sys.argv) < 3:
+        print('batch_ingest.py matsim_output_path database [--workers N] [--kinds %s] [--sinks %s] [--batch-size N] [--parser %s] [--profile %s]' % (','.join(KINDS), ','.join(ingest_events.SINKS), '|'.join(engine.BACKENDS), '|'.join(database.PROFILES)))
+        exit()
+
+    source = pathlib.Path(sys.argv[1]).resolve()
+    destination = pathlib.Path(sys.argv[2])
+
+    sources = find_sources(source, kinds)
+
+    print('Ingesting %d files with %d workers from:' % (len(sources), workers))
+    print('    %s' % source)
+    print('')
+
+    print('Will write to:')
+    print('    %s' % destination)
+    print('')
+
+    directory = pathlib.Path('%s.batch' % destination)
+    directory.mkdir(exist_ok = True)
+
+    start = time.time()
+
+    connection = database.connect(str(destination), profile)
+    merged = []
+
+    # Workers only write to their own shard, the shards are merged here one at a time as they finish
+    with concurrent.futures.ProcessPoolExecutor(workers) as executor:
+        futures = {
+            executor.submit(ingest, kind, path, str(directory / ('shard_%d.db' % index)), str(iteration), sinks, batch_size, parser) : (kind, path)
+            for index, (kind, path, iteration) in enumerate(sources) }
+
+        for future in concurrent.futures.as_completed(futures):
+            kind, path = futures[future]
+
+            try:
+                shard_database, tables, count = future.result()
+            except Exception as error:
+                print('   Could not read %s: %s' % (os.path.basename(path), error))
+                continue
+
+            merge(connection, shard_database, tables)
+            os.remove(shard_database)
+            merged += tables
+
+            print('   Read %d %s from %s into %s' % (count, kind, os.path.basename(path), ', '.join(tables)))
+
+    shutil.rmtree(str(directory))
+
+    database.analyze(connection, merged, profile)
+    connection.close()
+
+    print('\nFinished %d files in %.1fs\n' % (len(sources), time.time() - start))
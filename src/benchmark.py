@@ -0,0 +1,364 @@
+import gzip
+import xml.sax
+import pathlib, tempfile
+import sys, sqlite3
+import time, random, heapq
+import gc, tracemalloc, functools
+
+import numpy as np
+
+import options
+import engine, database, convert
+from writer import BufferedWriter, make_create_query
+from tracking import VehicleTable
+import read_events, ingest_events, read_plans, plans_filter
+from read_population import PopulationReader
+from read_distances import DistancesReader
+from read_plans import PlansReader
+
+def agent_events(person, rng, links, legs):
+    """ Yields (time, xml) tuples for one agent travelling by car between random links. """
+    link = rng.randrange(links)
+    timestamp = 5 * 3600.0 + rng.randrange(4 * 3600)
+
+    for leg in range(legs):
+        if leg == 0:
+            yield timestamp, '<event time="%.1f" type="actend" person="%d" link="%d" actType="home"  />' % (timestamp, person, link)
+        else:
+            yield timestamp, '<event time="%.1f" type="actend" person="%d" link="%d" actType="work"  />' % (timestamp, person, link)
+
+        yield timestamp, '<event time="%.1f" type="departure" person="%d" link="%d" legMode="car"  />' % (timestamp, person, link)
+        yield timestamp, '<event time="%.1f" type="PersonEntersVehicle" person="%d" vehicle="%d"  />' % (timestamp, person, person)
+
+        for step in range(rng.randrange(5, 20)):
+            yield timestamp, '<event time="%.1f" type="left link" vehicle="%d" link="%d"  />' % (timestamp, person, link)
+            link = (link + rng.randrange(1, 50)) % links
+            yield timestamp, '<event time="%.1f" type="entered link" vehicle="%d" link="%d" legMode="car"  />' % (timestamp, person, link)
+            timestamp += rng.randrange(5, 120)
+
+        yield timestamp, '<event time="%.1f" type="PersonLeavesVehicle" person="%d" vehicle="%d"  />' % (timestamp, person, person)
+        yield timestamp, '<event time="%.1f" type="arrival" person="%d" link="%d" legMode="car"  />' % (timestamp, person, link)
+        yield timestamp, '<event time="%.1f" type="actstart" person="%d" link="%d" actType="%s"  />' % (timestamp, person, link, 'work' if leg % 2 == 0 else 'home')
+
+        timestamp += rng.randrange(3600, 4 * 3600)
+
+def generate_events(path, events, links = 10000, legs = 2, seed = 0):
+    """ Writes a time-ordered synthetic MATSim events file with at least the given number of events. """
+    rng = random.Random(seed)
+    persons = max(1, events // (legs * 30))
+
+    with gzip.open(str(path), 'wt', compresslevel = 1) as f:
+        f.write('<?xml version="1.0" encoding="utf-8"?>\n<events version="1.0">\n')
+
+        for timestamp, line in heapq.merge(*[agent_events(person, rng, links, legs) for person in range(persons)], key = lambda item: item[0]):
+            f.write('\t')
+            f.write(line)
+            f.write('\n')
+
+        f.write('</events>\n')
+
+def generate_plans(path, persons, plans = 5, legs = 3, links = 10000, seed = 0):
+    """ Writes a synthetic MATSim plans file where each person has several plans, one of them selected. """
+    rng = random.Random(seed)
+
+    with gzip.open(str(path), 'wt', compresslevel = 1) as f:
+        f.write('<?xml version="1.0" encoding="utf-8"?>\n<population>\n')
+
+        for person in range(persons):
+            f.write('<person id="%d">\n' % person)
+            f.write('<attributes><attribute name="age" class="java.lang.Integer">%d</attribute></attributes>\n' % rng.randrange(18, 90))
+            selected = rng.randrange(plans)
+
+            for plan in range(plans):
+                f.write('<plan score="%f" selected="%s">\n' % (rng.random(), 'yes' if plan == selected else 'no'))
+                timestamp = 6 * 3600 + rng.randrange(4 * 3600)
+
+                for leg in range(legs):
+                    f.write('<activity type="%s" link="%d" x="%.1f" y="%.1f" end_time="%02d:%02d:%02d" />\n' % (
+                        'home' if leg == 0 else 'work', rng.randrange(links), rng.random() * 1000, rng.random() * 1000,
+                        timestamp // 3600, timestamp // 60 % 60, timestamp % 60))
+
+                    route = [rng.randrange(links) for step in range(rng.randrange(1, 20))]
+                    f.write('<leg mode="%s" dep_time="%02d:%02d:%02d" trav_time="00:20:00" arr_time="%02d:%02d:%02d">\n' % (
+                        rng.choice(('car', 'pt', 'walk')), timestamp // 3600, timestamp // 60 % 60, timestamp % 60,
+                        (timestamp + 1200) // 3600, (timestamp + 1200) // 60 % 60, timestamp % 60))
+                    f.write('<route type="links" start_link="%d" end_link="%d" trav_time="00:20:00" distance="%.1f" vehicleRefId="null">%s</route>\n' % (
+                        route[0], route[-1], rng.random() * 10000, ' '.join(map(str, route))))
+                    f.write('</leg>\n')
+
+                    timestamp += rng.randrange(1800, 4 * 3600)
+
+                f.write('<activity type="home" link="%d" x="%.1f" y="%.1f" />\n</plan>\n' % (rng.randrange(links), rng.random() * 1000, rng.random() * 1000))
+
+            f.write('</person>\n')
+
+        f.write('</population>\n')
+
+def benchmark_writer(directory, rows, batch_sizes):
+    data = [(None, float(i), 'entered link', str(i % 1000), 'link%d' % (i % 5000), None, str(i % 700), 'car') for i in range(rows)]
+    query = read_events.EventsReader.make_query()
+
+    print('Inserting %d rows:' % rows)
+
+    connection = sqlite3.connect(str(directory / 'per_row.db'))
+    cursor = connection.cursor()
+    read_events.create_tables(cursor)
+
+    start = time.time()
+    for row in data:
+        cursor.execute(query, row)
+    connection.commit()
+    print('    cursor.execute per row:    %12.0f rows/s' % (rows / (time.time() - start)))
+    connection.close()
+
+    for batch_size in batch_sizes:
+        connection = sqlite3.connect(str(directory / ('batch_%d.db' % batch_size)))
+        cursor = connection.cursor()
+        read_events.create_tables(cursor)
+
+        start = time.time()
+        writer = BufferedWriter(cursor, query, batch_size)
+        for row in data:
+            writer.append(row)
+        writer.flush()
+        connection.commit()
+        print('    batch size %-8d        %12.0f rows/s' % (batch_size, rows / (time.time() - start)))
+        connection.close()
+
+def benchmark_reader(directory, events, batch_sizes):
+    source = directory / 'events.xml.gz'
+    print('Generating synthetic events file with %d events ...' % events)
+    generate_events(source, events)
+
+    print('Parsing with read_events.EventsReader:')
+
+    for batch_size in batch_sizes:
+        connection = sqlite3.connect(str(directory / ('reader_%d.db' % batch_size)))
+        cursor = connection.cursor()
+        read_events.create_tables(cursor)
+
+        start = time.time()
+        reader = read_events.EventsReader(cursor, batch_size)
+        with gzip.open(str(source)) as f:
+            xml.sax.parse(f, reader)
+        connection.commit()
+        print('    batch size %-8d        %12.0f rows/s (%d rows)' % (batch_size, reader.count / (time.time() - start), reader.count))
+        connection.close()
+
+class CountingHandler(xml.sax.ContentHandler):
+    def __init__(self):
+        self.count = 0
+
+    def startElement(self, name, attributes):
+        if name == 'event':
+            self.count += 1
+
+def benchmark_parser(directory, events, backends):
+    source = directory / 'events.xml.gz'
+    print('Generating synthetic events file with %d events ...' % events)
+    generate_events(source, events)
+
+    for backend in backends:
+        if backend == 'lxml' and engine.lxml is None:
+            print('    %-8s not installed' % backend)
+            continue
+
+        start = time.time()
+        handler = CountingHandler()
+        with gzip.open(str(source)) as f:
+            engine.parse(f, handler, backend)
+        tokenize_rate = handler.count / (time.time() - start)
+
+        connection = sqlite3.connect(':memory:')
+        cursor = connection.cursor()
+        read_events.create_tables(cursor)
+
+        start = time.time()
+        reader = read_events.EventsReader(cursor)
+        with gzip.open(str(source)) as f:
+            engine.parse(f, reader, backend)
+        connection.commit()
+        reader_rate = handler.count / (time.time() - start)
+        connection.close()
+
+        print('    %-8s %12.0f events/s tokenizing, %12.0f events/s with EventsReader' % (backend, tokenize_rate, reader_rate))
+
+def benchmark_profile(directory, events, profiles):
+    source = directory / 'events.xml.gz'
+    print('Generating synthetic events file with %d events ...' % events)
+    generate_events(source, events)
+
+    print('Ingesting all events sinks:')
+
+    for profile in profiles:
+        path = directory / ('profile_%s.db' % profile)
+        connection = database.connect(str(path), profile)
+        cursor = connection.cursor()
+
+        start = time.time()
+        ingest_events.create_tables(cursor, ingest_events.SINKS, 'benchmark')
+        dispatcher = ingest_events.make_dispatcher(cursor, ingest_events.SINKS)
+        dispatcher.display = float('inf')
+
+        for reader in dispatcher.readers.values():
+            reader.display = float('inf')
+
+        with gzip.open(str(source)) as f:
+            engine.parse(f, dispatcher)
+
+        connection.commit()
+        ingest_events.rename_tables(cursor, ingest_events.SINKS, 'benchmark')
+        connection.commit()
+        database.analyze(connection, ingest_events.table_names(ingest_events.SINKS, 'benchmark'), profile)
+        connection.close()
+
+        rows = sum([reader.count for reader in dispatcher.readers.values()])
+        print('    %-8s %12.0f rows/s (%d rows)' % (profile, rows / (time.time() - start), rows))
+
+def benchmark_plans(directory, persons, plans):
+    source = directory / 'plans.xml.gz'
+    print('Generating synthetic plans file with %d persons and %d plans each ...' % (persons, plans))
+    generate_plans(source, persons, plans)
+
+    readers = (
+        ('population', PopulationReader, lambda cursor: cursor.execute(make_create_query('_population', PopulationReader.FIELDS, PopulationReader.TYPES))),
+        ('distances', DistancesReader, lambda cursor: cursor.execute(make_create_query('_distances', DistancesReader.FIELDS, DistancesReader.TYPES))),
+        ('plans', PlansReader, read_plans.create_tables))
+
+    for name, reader_type, create_tables in readers:
+        for selected in (False, True):
+            connection = sqlite3.connect(':memory:')
+            cursor = connection.cursor()
+            create_tables(cursor)
+
+            start = time.time()
+            reader = reader_type(cursor)
+            reader.display = float('inf')
+
+            with plans_filter.open_plans(str(source), selected) as f:
+                engine.parse(f, reader)
+
+            connection.commit()
+            connection.close()
+
+            print('    %-12s %-16s %12.0f persons/s' % (name, 'selected only' if selected else 'all plans', persons / (time.time() - start)))
+
+def benchmark_convert(rows):
+    rng = random.Random(0)
+    samples = (
+        ('repeated', ['%02d:%02d:%02d' % (rng.randrange(30), rng.randrange(60), rng.randrange(60)) for i in range(rows)]),
+        ('distinct', ['%02d:%02d:%04.1f' % (i // 36000, i // 600 % 60, i % 600 / 10) for i in range(rows)]))
+
+    for name, times in samples:
+        print('Parsing %d %s HH:MM:SS times (%d distinct):' % (rows, name, len(set(times))))
+
+        start = time.time()
+        for value in times:
+            float(np.dot(np.array([float(d) for d in value.split(':')]), np.array([3600, 60, 1])))
+        print('    np.dot:                    %12.0f times/s' % (rows / (time.time() - start)))
+
+        start = time.time()
+        for value in times:
+            convert.parse_time(value)
+        print('    arithmetic:                %12.0f times/s' % (rows / (time.time() - start)))
+
+        # Only pays off if most times repeat, which is why convert.parse_time is not cached
+        cached = functools.lru_cache(maxsize = 131072)(convert.parse_time)
+        start = time.time()
+        for value in times:
+            cached(value)
+        print('    arithmetic, lru_cache:     %12.0f times/s' % (rows / (time.time() - start)))
+
+    fields, types = read_events.EventsReader.ATTRIBUTES, read_events.EventsReader.TYPES
+    converters = convert.converters(fields, types)
+    data = [(i, '%.1f' % i, 'entered link', str(i % 1000), str(i % 5000), None, str(i % 700), 'car') for i in range(rows)]
+
+    print('Converting %d events rows to the column types:' % rows)
+
+    start = time.time()
+    [tuple([value if converter is None or value is None else converter(value) for converter, value in zip(converters, row)]) for row in data]
+    print('    per column:                %12.0f rows/s' % (rows / (time.time() - start)))
+
+    row_converter = convert.compile_row(converters)
+    start = time.time()
+    list(map(row_converter, data))
+    print('    compiled row:              %12.0f rows/s' % (rows / (time.time() - start)))
+
+def fill_vehicles(vehicles, fleet, links):
+    for vehicle in range(fleet):
+        # Fresh strings like the ones the parser creates
+        vehicles[str(vehicle)] = ('%d' % (vehicle % links), '%.1f' % (vehicle * 0.5))
+
+def benchmark_vehicles(fleet, links = 100000):
+    print('Tracking %d vehicles en route:' % fleet)
+
+    for name, make in (('dict of tuples', dict), ('VehicleTable', VehicleTable)):
+        gc.collect()
+        tracemalloc.start()
+
+        vehicles = make()
+        fill_vehicles(vehicles, fleet, links)
+
+        size = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+
+        rng = random.Random(0)
+        start = time.time()
+
+        for step in range(fleet):
+            vehicle = str(rng.randrange(fleet))
+
+            if isinstance(vehicles, VehicleTable):
+                link, enter_time = vehicles.pop(vehicle)
+                vehicles.add(vehicle, str(rng.randrange(links)), enter_time + 10.0)
+            else:
+                link, enter_time = vehicles.pop(vehicle)
+                vehicles[vehicle] = (str(rng.randrange(links)), str(float(enter_time) + 10.0))
+
+        rate = fleet / (time.time() - start)
+
+        start = time.time()
+        gc.collect()
+        collect_time = time.time() - start
+
+        print('    %-16s %8.1f MB %8.0f B/vehicle %10.0f leave/enter per s, full gc %.3fs' % (name, size / 1e6, size / fleet, rate, collect_time))
+        del vehicles
+
+if __name__ == '__main__':
+    rows = options.pop_option(sys.argv, '--rows', 1000000, int)
+    events = options.pop_option(sys.argv, '--events', None, int)
+    batch_sizes = [int(b) for b in options.pop_option(sys.argv, '--batch-sizes', '1,100,1000,10000').split(',')]
+    backends = options.pop_option(sys.argv, '--parsers', ','.join(engine.BACKENDS)).split(',')
+    profiles = options.pop_option(sys.argv, '--profiles', ','.join(database.PROFILES)).split(',')
+    fleet = options.pop_option(sys.argv, '--fleet', 500000, int)
+    persons = options.pop_option(sys.argv, '--persons', 100000, int)
+    plans = options.pop_option(sys.argv, '--plans', 5, int)
+
+    if len(sys.argv) < 2:
+        print('benchmark.py writer [--rows N] [--events N] [--batch-sizes 1,100,...]')
+        print('benchmark.py parser [--events N] [--parsers %s]' % ','.join(engine.BACKENDS))
+        print('benchmark.py profile [--events N] [--profiles %s]' % ','.join(database.PROFILES))
+        print('benchmark.py convert [--rows N]')
+        print('benchmark.py vehicles [--fleet N]')
+        print('benchmark.py plans [--persons N] [--plans N]')
+        exit()
+
+    with tempfile.TemporaryDirectory() as directory:
+        directory = pathlib.Path(directory)
+
+        if sys.argv[1] == 'writer':
+            benchmark_writer(directory, rows, batch_sizes)
+            print('')
+            benchmark_reader(directory, events or 1000000, batch_sizes)
+        elif sys.argv[1] == 'parser':
+            benchmark_parser(directory, events or 10000000, backends)
+        elif sys.argv[1] == 'profile':
+            benchmark_profile(directory, events or 1000000, profiles)
+        elif sys.argv[1] == 'convert':
+            benchmark_convert(rows)
+        elif sys.argv[1] == 'vehicles':
+            benchmark_vehicles(fleet)
+        elif sys.argv[1] == 'plans':
+            benchmark_plans(directory, persons, plans)
+        else:
+            print('Unknown benchmark: %s' % sys.argv[1])
@@ -0,0 +1,135 @@
+import os, sys, gzip, pickle
+import xml.sax
+
+import engine
+from chunks import bgzf_blocks, read_chunks, range_chunks, ChunkStream, ROOT_TAG, CHUNK_SIZE
+
+DEFAULT_INTERVAL = 1000000
+
+class Checkpoints:
+    """
+        Checkpoints of one output (e.g. events_<suffix>), stored in _checkpoints next to the rows they belong to,
+        so a checkpoint and its rows are always committed together.
+    """
+
+    def __init__(self, cursor, name, source):
+        self.cursor = cursor
+        self.name = name
+
+        stat = os.stat(source)
+        self.source = (str(source), stat.st_size, stat.st_mtime)
+
+        cursor.execute('create table if not exists _checkpoints (name text primary key, source text, size integer, mtime real, events integer, offset integer, state blob)')
+
+    def load(self):
+        """ Returns (events, offset, state) of the last checkpoint, or None. """
+        self.cursor.execute('select source, size, mtime, events, offset, state from _checkpoints where name = ?', (self.name,))
+        row = self.cursor.fetchone()
+        if row is None: return None
+
+        if tuple(row[:3]) != self.source:
+            raise RuntimeError('The checkpoint of %s was written for %s, which changed or is not the source file' % (self.name, row[0]))
+
+        return row[3], row[4], pickle.loads(row[5])
+
+    def save(self, events, offset, state):
+        self.cursor.execute(
+            'insert or replace into _checkpoints (name, source, size, mtime, events, offset, state) values (?,?,?,?,?,?,?)',
+            (self.name,) + self.source + (events, offset, pickle.dumps(state, pickle.HIGHEST_PROTOCOL)))
+
+    def clear(self):
+        self.cursor.execute('delete from _checkpoints where name = ?', (self.name,))
+
+        self.cursor.execute('select count(*) from _checkpoints')
+        if self.cursor.fetchone()[0] == 0:
+            self.cursor.execute('drop table _checkpoints')
+
+class CheckpointingHandler(xml.sax.ContentHandler):
+    """
+        Forwards the events to a reader. Every interval events, the batches of the reader are flushed and
+        committed together with a checkpoint: the byte offset of the next event in the uncompressed file
+        and the reader attributes listed in its CHECKPOINT_STATE.
+    """
+
+    def __init__(self, reader, connection, checkpoints, interval = DEFAULT_INTERVAL, events = 0, base = 0, interning = None):
+        self.reader = reader
+        self.connection = connection
+        self.checkpoints = checkpoints
+        self.interval = interval
+        self.interning = interning
+
+        self.events = events
+        self.next = events + interval
+
+        # Offset of the parsed stream in the uncompressed file
+        self.base = base
+        self.locator = None
+
+    def setDocumentLocator(self, locator):
+        self.locator = locator
+
+    def startElement(self, name, attributes):
+        if name == 'event':
+            if self.events >= self.next:
+                self.checkpoint()
+
+            self.events += 1
+
+        self.reader.startElement(name, attributes)
+
+    def endDocument(self):
+        self.reader.endDocument()
+
+    def checkpoint(self):
+        self.reader.flush()
+
+        if self.interning is not None:
+            self.interning.flush()
+
+        state = { name : getattr(self.reader, name) for name in self.reader.CHECKPOINT_STATE }
+        self.checkpoints.save(self.events, self.base + self.locator.getByteIndex(), state)
+        self.connection.commit()
+
+        self.next = self.events + self.interval
+
+def resume_chunks(source, offset):
+    """ Yields the uncompressed content of an events file from the given offset on. """
+    if not source.endswith('.gz'):
+        yield from read_chunks(source, offset)
+        return
+
+    blocks = bgzf_blocks(source)
+
+    if blocks is not None:
+        yield from read_chunks(source, offset, blocks)
+        return
+
+    # A single gzip stream has no access points, so everything before the offset is decompressed and skipped
+    with gzip.open(source) as f:
+        f.seek(offset)
+
+        while True:
+            data = f.read(CHUNK_SIZE)
+            if len(data) == 0: return
+            yield data
+
+def parse(source, reader, connection, checkpoints, interval = DEFAULT_INTERVAL, resumed = None, interning = None):
+    """ Parses an events file with checkpoints, continuing after the resumed checkpoint if one is given. """
+    if resumed is None:
+        handler = CheckpointingHandler(reader, connection, checkpoints, interval, interning = interning)
+
+        with (gzip.open(source) if source.endswith('.gz') else open(source, 'rb')) as f:
+            engine.parse(f, handler, 'expat')
+    else:
+        events, offset, state = resumed
+
+        for name, value in state.items():
+            setattr(reader, name, value)
+
+        print('Resuming after %d events at byte %d ...\n' % (events, offset))
+
+        # The events are parsed without the header of the file, wrapped into a new root element
+        handler = CheckpointingHandler(reader, connection, checkpoints, interval, events, offset - len(ROOT_TAG), interning)
+        engine.parse(ChunkStream(range_chunks(resume_chunks(source, offset), offset, sys.maxsize)), handler, 'expat')
+
+    return handler
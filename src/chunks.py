@@ -0,0 +1,170 @@
+import struct, zlib, bisect
+
+EVENT_TAG = b'<event '
+ROOT_TAG = b'<events>'
+END_TAG = b'</events>'
+CHUNK_SIZE = 1 << 20
+
+# Uncompressed bytes per BGZF block and the empty block that marks the end of a BGZF file
+BGZF_BLOCK_SIZE = 0xff00
+BGZF_EOF = bytes.fromhex('1f8b08040000000000ff0600424302001b0003000000000000000000')
+
+def bgzf_blocks(path):
+    """ Returns (compressed offset, uncompressed offset, compressed size) for each block of a BGZF file, or None for other files. """
+    blocks = []
+    coffset, uoffset = 0, 0
+
+    with open(path, 'rb') as f:
+        while True:
+            header = f.read(12)
+            if len(header) == 0: break
+
+            magic, method, flags, xlen = header[:2], header[2], header[3], struct.unpack('<H', header[10:12])[0]
+            if magic != b'\x1f\x8b' or method != 8 or not flags & 4: return None
+
+            extra = f.read(xlen)
+            bsize = None
+
+            position = 0
+            while position + 4 <= len(extra):
+                si1, si2, slen = extra[position], extra[position + 1], struct.unpack('<H', extra[position + 2:position + 4])[0]
+                if si1 == 66 and si2 == 67: bsize = struct.unpack('<H', extra[position + 4:position + 6])[0] + 1
+                position += 4 + slen
+
+            if bsize is None: return None
+
+            f.seek(coffset + bsize - 4)
+            isize = struct.unpack('<I', f.read(4))[0]
+
+            blocks.append((coffset, uoffset, bsize))
+            coffset += bsize
+            uoffset += isize
+
+    blocks.append((coffset, uoffset, 0))
+    return blocks
+
+def bgzf_block(data, level = 6):
+    """ Compresses data into one BGZF block (a gzip member with its size in the BC extra field). """
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+    deflated = compressor.compress(data) + compressor.flush()
+
+    if len(deflated) + 26 > 65536:
+        # Incompressible data, the block size has to fit into 16 bits
+        half = len(data) // 2
+        return bgzf_block(data[:half], level) + bgzf_block(data[half:], level)
+
+    header = struct.pack('<BBBBIBBHBBHH', 31, 139, 8, 4, 0, 0, 255, 6, 66, 67, 2, len(deflated) + 25)
+    return header + deflated + struct.pack('<II', zlib.crc32(data), len(data))
+
+def write_bgzf(chunks, path, level = 6):
+    """ Writes uncompressed chunks as a BGZF file, which can still be read with gzip. """
+    with open(path, 'wb') as f:
+        pending = b''
+
+        for chunk in chunks:
+            data = pending + chunk
+            count = len(data) // BGZF_BLOCK_SIZE
+
+            for index in range(count):
+                f.write(bgzf_block(data[index * BGZF_BLOCK_SIZE:(index + 1) * BGZF_BLOCK_SIZE], level))
+
+            pending = data[count * BGZF_BLOCK_SIZE:]
+
+        if len(pending) > 0:
+            f.write(bgzf_block(pending, level))
+
+        f.write(BGZF_EOF)
+
+def read_chunks(path, start, blocks = None):
+    """ Yields the uncompressed content of a plain or BGZF file starting at the given uncompressed offset. """
+    with open(path, 'rb') as f:
+        if blocks is None:
+            f.seek(start)
+
+            while True:
+                data = f.read(CHUNK_SIZE)
+                if len(data) == 0: return
+                yield data
+        else:
+            index = bisect.bisect_right([block[1] for block in blocks], start) - 1
+
+            for coffset, uoffset, bsize in blocks[index:-1]:
+                f.seek(coffset)
+                data = zlib.decompress(f.read(bsize), 31)
+                yield data[start - uoffset:] if uoffset < start else data
+
+def range_chunks(chunks, start, end):
+    """ Yields the bytes of all events whose '<event ' tag starts in [start, end). Chunks must begin at offset start. """
+    keep = len(END_TAG) - 1
+    pending = b''
+    offset = start
+    emitting = False
+
+    for chunk in chunks:
+        data = pending + chunk
+        base = offset - len(pending)
+        offset += len(chunk)
+
+        if not emitting:
+            index = data.find(EVENT_TAG)
+            stop = data.find(END_TAG)
+
+            if index < 0 or (stop >= 0 and stop < index):
+                if stop >= 0: return
+                pending = data[-keep:]
+                continue
+
+            if base + index >= end: return
+
+            emitting = True
+            data = data[index:]
+            base += index
+
+        stops = [index for index in (data.find(EVENT_TAG, max(0, end - base)), data.find(END_TAG)) if index >= 0]
+
+        if len(stops) > 0:
+            yield data[:min(stops)]
+            return
+
+        yield data[:-keep]
+        pending = data[-keep:]
+
+    if emitting:
+        yield pending
+
+class ChunkStream:
+    """ File-like view on a chunk iterator, wrapped into a root element, for the parser backends. """
+
+    def __init__(self, chunks):
+        self.chunks = self.wrap(chunks)
+        self.buffer = b''
+        self.position = 0
+
+    def wrap(self, chunks):
+        yield ROOT_TAG
+        yield from chunks
+        yield END_TAG
+
+    def read(self, size = -1):
+        while size < 0 or len(self.buffer) - self.position < size:
+            chunk = next(self.chunks, None)
+            if chunk is None: break
+
+            self.buffer = self.buffer[self.position:] + chunk
+            self.position = 0
+
+        if size < 0:
+            size = len(self.buffer) - self.position
+
+        data = self.buffer[self.position:self.position + size]
+        self.position += len(data)
+        return data
+
+    def close(self):
+        self.chunks.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
@@ -0,0 +1,40 @@
+# Python types for the SQLite column types of the reader schemas (text and primary keys are kept)
+PYTHON_TYPES = { 'real' : float, 'integer' : int }
+
+def parse_time(value):
+    """ Converts a HH:MM:SS time string into seconds. """
+    hours, minutes, seconds = value.split(':')
+    return float(int(hours) * 3600 + int(minutes) * 60) + float(seconds)
+
+def parse_seconds(value):
+    """ Converts a time given either in seconds or as HH:MM:SS, e.g. on the command line. """
+    return parse_time(value) if ':' in value else float(value)
+
+def converters(fields, types, interning = None, dimensions = {}):
+    """
+        Per-column converters that turn the string attributes of the parser into the declared column types.
+        With interning, the ids of the given dimensions are replaced by their integers instead.
+    """
+    return tuple([
+        interning.get(dimensions[field]) if interning is not None and field in dimensions else PYTHON_TYPES.get(type)
+        for field, type in zip(fields, types)])
+
+def compile_row(converters):
+    """
+        Builds one function that converts a whole row, so flushing a batch does not loop over
+        the columns in Python. Missing values (None) are passed through.
+    """
+    if converters is None or all([converter is None for converter in converters]):
+        return None
+
+    names = {}
+    values = []
+
+    for index, converter in enumerate(converters):
+        if converter is None:
+            values.append('row[%d]' % index)
+        else:
+            names['convert_%d' % index] = converter
+            values.append('(None if row[%d] is None else convert_%d(row[%d]))' % (index, index, index))
+
+    return eval('lambda row: (%s,)' % ', '.join(values), names)
@@ -0,0 +1,66 @@
+import pathlib
+import numpy as np
+
+try:
+    import scipy.sparse
+except ImportError:
+    scipy = None
+
+ARRAYS = ('offsets', 'targets', 'links', 'lengths')
+
+class Graph:
+    """
+        Compressed sparse row adjacency of a network. The outgoing links of node i are the entries
+        offsets[i]:offsets[i + 1] of targets (the to node), links (the link index) and lengths (the length
+        attribute of the link in the network file).
+        Node index i is the row nodes.rowid = i + 1 of the database, link index j is links.rowid = j + 1.
+    """
+
+    def __init__(self, offsets, targets, links, lengths):
+        self.offsets = offsets
+        self.targets = targets
+        self.links = links
+        self.lengths = lengths
+
+    @property
+    def node_count(self):
+        return len(self.offsets) - 1
+
+    def neighbours(self, node):
+        return self.targets[self.offsets[node]:self.offsets[node + 1]]
+
+    def matrix(self):
+        """ The adjacency as a scipy.sparse.csr_matrix weighted by link length, e.g. for scipy.sparse.csgraph. Parallel links stay separate entries. """
+        if scipy is None:
+            raise RuntimeError('The adjacency matrix needs the scipy package')
+
+        return scipy.sparse.csr_matrix((self.lengths, self.targets, self.offsets), shape = (self.node_count, self.node_count))
+
+def build(node_count, sources, targets, lengths):
+    """ Builds the graph from per-link arrays (source node, target node, length); links with a negative source are left out. """
+    sources = np.asarray(sources, dtype = np.int64)
+    targets = np.asarray(targets, dtype = np.int64)
+    lengths = np.asarray(lengths, dtype = np.float64)
+
+    links = np.flatnonzero(sources >= 0)
+    links = links[np.argsort(sources[links], kind = 'stable')]
+
+    offsets = np.zeros(node_count + 1, dtype = np.int64)
+    np.cumsum(np.bincount(sources[links], minlength = node_count), out = offsets[1:])
+
+    index_type = np.int32 if max(node_count, len(sources)) < 2 ** 31 else np.int64
+    return Graph(offsets, targets[links].astype(index_type), links.astype(index_type), lengths[links])
+
+def save(directory, graph):
+    directory = pathlib.Path(directory)
+    directory.mkdir(parents = True, exist_ok = True)
+
+    for name in ARRAYS:
+        np.save(str(directory / ('%s.npy' % name)), getattr(graph, name))
+
+def load(directory, mmap = True):
+    """ Loads a graph written by save, memory mapped by default so only the touched pages are read. """
+    directory = pathlib.Path(directory)
+    mode = 'r' if mmap else None
+
+    return Graph(*[np.load(str(directory / ('%s.npy' % name)), mmap_mode = mode) for name in ARRAYS])
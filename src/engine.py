@@ -0,0 +1,106 @@
+import xml.sax
+import xml.sax.xmlreader
+import xml.parsers.expat
+
+try:
+    import lxml.etree
+except ImportError:
+    lxml = None
+
+BACKENDS = ('expat', 'sax', 'lxml')
+DEFAULT_BACKEND = 'expat'
+
+def overrides(handler, method):
+    return getattr(type(handler), method, None) is not getattr(xml.sax.ContentHandler, method)
+
+class ExpatLocator(xml.sax.xmlreader.Locator):
+    """ Locator of the expat backend, which also gives the byte offset of the current element in the stream. """
+
+    def __init__(self, parser):
+        self.parser = parser
+
+    def getLineNumber(self):
+        return self.parser.CurrentLineNumber
+
+    def getColumnNumber(self):
+        return self.parser.CurrentColumnNumber
+
+    def getByteIndex(self):
+        return self.parser.CurrentByteIndex
+
+    def skip(self, name):
+        """
+            Skips the children of the element that was just started: expat stops reporting their starts (so no
+            attribute dicts are built for them) until the element ends, which the handler gets as usual.
+            Elements of the same name must not be nested in it.
+        """
+        parser = self.parser
+        start, end, characters = parser.StartElementHandler, parser.EndElementHandler, parser.CharacterDataHandler
+
+        def skipped_end(element):
+            if not element == name: return
+
+            parser.StartElementHandler = start
+            parser.EndElementHandler = end
+            parser.CharacterDataHandler = characters
+
+            if end is not None: end(element)
+
+        parser.StartElementHandler = None
+        parser.EndElementHandler = skipped_end
+        parser.CharacterDataHandler = None
+
+def parse_sax(stream, handler):
+    xml.sax.parse(stream, handler)
+
+def parse_expat(stream, handler):
+    """ Binds the handler callbacks directly to pyexpat, so attributes arrive as plain dicts. """
+    parser = xml.parsers.expat.ParserCreate()
+    parser.buffer_text = True
+    parser.buffer_size = 65536
+
+    parser.StartElementHandler = handler.startElement
+
+    if overrides(handler, 'endElement'):
+        parser.EndElementHandler = handler.endElement
+
+    if overrides(handler, 'characters'):
+        parser.CharacterDataHandler = handler.characters
+
+    handler.setDocumentLocator(ExpatLocator(parser))
+    handler.startDocument()
+    parser.ParseFile(stream)
+    handler.endDocument()
+
+def parse_lxml(stream, handler):
+    if lxml is None:
+        raise RuntimeError('The lxml parser backend needs the lxml package')
+
+    characters = overrides(handler, 'characters')
+
+    handler.startDocument()
+
+    for event, element in lxml.etree.iterparse(stream, events = ('start', 'end')):
+        if event == 'start':
+            # Elements are cleared once they end, so handlers get a copy of the attributes
+            handler.startElement(element.tag, dict(element.attrib))
+        else:
+            if characters and element.text is not None:
+                handler.characters(element.text)
+
+            handler.endElement(element.tag)
+
+            element.clear()
+            while element.getprevious() is not None:
+                del element.getparent()[0]
+
+    handler.endDocument()
+
+PARSERS = { 'sax' : parse_sax, 'expat' : parse_expat, 'lxml' : parse_lxml }
+
+def parse(stream, handler, backend = DEFAULT_BACKEND):
+    """ Parses a binary XML stream with the given backend, calling the SAX-style handler methods. """
+    if not backend in PARSERS:
+        raise ValueError('Unknown parser backend: %s (available: %s)' % (backend, ', '.join(BACKENDS)))
+
+    PARSERS[backend](stream, handler)
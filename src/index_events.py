@@ -0,0 +1,162 @@
+import gzip
+import xml.sax
+import re, os
+import pathlib
+import sys
+import time
+import numpy as np
+
+import options
+from chunks import bgzf_blocks, read_chunks, range_chunks, write_bgzf, ChunkStream, CHUNK_SIZE
+
+# MATSim writes the time as the first attribute of each event
+EVENT_TIME = re.compile(rb'<event time="([^"]*)"')
+
+# Uncompressed bytes between two indexed events, about one BGZF block
+DEFAULT_SPACING = 1 << 16
+
+def index_path(source):
+    return '%s.index.npz' % source
+
+def build_index(source, blocks = None, spacing = DEFAULT_SPACING):
+    """ Returns the uncompressed offsets and times of one event tag every spacing bytes of a plain or BGZF events file. """
+    offsets, times = [], []
+
+    keep = 4096
+    pending = b''
+    offset = 0
+    next_offset = 0
+
+    display = time.time()
+
+    for chunk in read_chunks(source, 0, blocks):
+        data = pending + chunk
+        base = offset - len(pending)
+        offset += len(chunk)
+
+        while True:
+            match = EVENT_TIME.search(data, max(0, next_offset - base))
+            if match is None: break
+
+            offsets.append(base + match.start())
+            times.append(float(match.group(1)))
+            next_offset = base + match.start() + spacing
+
+        # Keeps tags that are cut at the end of the chunk
+        pending = data[-keep:]
+
+        if display + 1.0 < time.time():
+            print('   Indexed %d MB ...' % (offset >> 20))
+            display = time.time()
+
+    return np.array(offsets, dtype = np.int64), np.array(times, dtype = np.float64)
+
+def save_index(source, blocks, offsets, times):
+    stat = os.stat(source)
+
+    np.savez(index_path(source),
+        offsets = offsets, times = times,
+        blocks = np.array(blocks or [], dtype = np.int64).reshape(-1, 3),
+        source = np.array([stat.st_size, stat.st_mtime]))
+
+def load_index(source):
+    """ Returns (blocks, offsets, times) of the index of an events file, or None if there is no index for this version of the file. """
+    path = index_path(source)
+    if not os.path.exists(path): return None
+
+    index = np.load(path)
+    stat = os.stat(source)
+
+    if tuple(index['source']) != (stat.st_size, stat.st_mtime):
+        print('The index %s is outdated, run index_events.py again' % path)
+        return None
+
+    blocks = [tuple(block) for block in index['blocks'].tolist()]
+    return blocks if len(blocks) > 0 else None, index['offsets'], index['times']
+
+def window_offsets(offsets, times, from_time = None, to_time = None):
+    """ Uncompressed byte range that contains all events in [from_time, to_time). Events are ordered by time. """
+    start, end = 0, sys.maxsize
+
+    if from_time is not None:
+        # Everything before the last indexed event earlier than from_time is earlier as well
+        index = np.searchsorted(times, from_time, 'left') - 1
+        if index >= 0: start = int(offsets[index])
+
+    if to_time is not None:
+        index = np.searchsorted(times, to_time, 'left')
+        if index < len(times): end = int(offsets[index])
+
+    return start, end
+
+def open_window(source, from_time = None, to_time = None):
+    """ Opens an events file for the events in [from_time, to_time). With an index, only the blocks in the window are read. """
+    index = load_index(source)
+
+    if index is None:
+        print('No index for %s, reading the whole file\n' % source)
+        return gzip.open(source) if source.endswith('.gz') else open(source, 'rb')
+
+    blocks, offsets, times = index
+    start, end = window_offsets(offsets, times, from_time, to_time)
+
+    return ChunkStream(range_chunks(read_chunks(source, start, blocks), start, end))
+
+class TimeWindowHandler(xml.sax.ContentHandler):
+    """ Forwards the events in [from_time, to_time) to a reader. """
+
+    def __init__(self, reader, from_time = None, to_time = None):
+        self.reader = reader
+        self.from_time = float('-inf') if from_time is None else from_time
+        self.to_time = float('inf') if to_time is None else to_time
+
+    def startElement(self, name, attributes):
+        if name == 'event':
+            etime = float(attributes['time'])
+            if etime < self.from_time or etime >= self.to_time: return
+
+        self.reader.startElement(name, attributes)
+
+    def endDocument(self):
+        self.reader.endDocument()
+
+if __name__ == '__main__':
+    output = options.pop_option(sys.argv, '--bgzip')
+    spacing = options.pop_option(sys.argv, '--spacing', DEFAULT_SPACING, int)
+
+    if len(sys.argv) < 2:
+        print('index_events.py source_xml [--bgzip output_xml_gz] [--spacing bytes]')
+        exit()
+
+    source = str(pathlib.Path(sys.argv[1]).resolve())
+
+    if output is not None:
+        print('Recompressing %s to BGZF:' % source)
+        print('    %s' % output)
+        print('')
+
+        with (gzip.open(source) if source.endswith('.gz') else open(source, 'rb')) as f:
+            write_bgzf(iter(lambda: f.read(CHUNK_SIZE), b''), output)
+
+        source = str(pathlib.Path(output).resolve())
+
+    blocks = None
+
+    if source.endswith('.gz'):
+        blocks = bgzf_blocks(source)
+
+        if blocks is None:
+            print('Random access needs an uncompressed or BGZF compressed events file, use --bgzip to recompress it')
+            exit()
+
+    print('Indexing events in:')
+    print('    %s' % source)
+    print('')
+
+    offsets, times = build_index(source, blocks, spacing)
+    save_index(source, blocks, offsets, times)
+
+    if len(times) > 0:
+        print('\nIndexed %d positions between times %f and %f' % (len(times), times[0], times[-1]))
+
+    print('Wrote %s' % index_path(source))
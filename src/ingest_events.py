@@ -0,0 +1,175 @@
+import xml.sax
+import pathlib
+import sys
+import time
+
+import options
+import engine, pipeline
+import database, intern
+from writer import DEFAULT_BATCH_SIZE
+from read_entered_link import TransparentDecompressionStream
+
+import read_events, read_entered_link, read_link_times
+
+SINKS = ('events', 'entered_link', 'link_times')
+
+class EventsDispatcher(xml.sax.ContentHandler):
+    """ Parses an events file once and forwards each event to the readers registered for its type. """
+
+    def __init__(self):
+        self.readers = {}
+        self.by_type = {}
+
+        self.display = time.time()
+        self.count = 0
+
+    def register(self, sink, reader, types):
+        self.readers[sink] = reader
+
+        for type in types:
+            self.by_type.setdefault(type, []).append(reader)
+
+    def startElement(self, name, attributes):
+        if not name == 'event': return
+
+        self.count += 1
+
+        if self.display + 1.0 < time.time():
+            print('   Dispatched %d events ...' % self.count)
+            self.display = time.time()
+
+        readers = self.by_type.get(attributes['type'])
+        if readers is None: return
+
+        for reader in readers:
+            reader.startElement(name, attributes)
+
+    def endDocument(self):
+        for reader in self.readers.values():
+            reader.endDocument()
+
+def create_tables(cursor, sinks, suffix, interning = None):
+    if 'events' in sinks:
+        read_events.create_tables(cursor, interning)
+
+    if 'entered_link' in sinks:
+        # The events sink already owns events_<suffix>, so entered link rows get their own table
+        read_entered_link.create_tables(cursor, suffix, 'entered_link', interning)
+
+    if 'link_times' in sinks:
+        read_link_times.create_tables(cursor, interning)
+
+def rename_tables(cursor, sinks, suffix):
+    if 'events' in sinks:
+        read_events.rename_tables(cursor, suffix)
+
+    if 'entered_link' in sinks:
+        read_entered_link.create_indexes(cursor, suffix, 'entered_link')
+        read_entered_link.rename_tables(cursor, suffix, 'entered_link')
+
+    if 'link_times' in sinks:
+        read_link_times.rename_tables(cursor, suffix)
+
+def table_names(sinks, suffix):
+    tables = []
+
+    if 'events' in sinks:
+        tables += ['%s_%s' % (table, suffix) for table, fields, types in read_events.EventsReader.TABLES]
+
+    if 'entered_link' in sinks:
+        tables.append('entered_link_%s' % suffix)
+
+    if 'link_times' in sinks:
+        tables.append('link_times_%s' % suffix)
+
+    return tables
+
+def make_dispatcher(cursor, sinks, batch_size = DEFAULT_BATCH_SIZE, interning = None):
+    dispatcher = EventsDispatcher()
+
+    if 'events' in sinks:
+        dispatcher.register('events', read_events.EventsReader(cursor, batch_size, interning), read_events.EventsReader.EVENT_TYPES)
+
+    if 'entered_link' in sinks:
+        dispatcher.register('entered_link', read_entered_link.EventsReader(cursor, batch_size, 'entered_link', interning), read_entered_link.EventsReader.EVENT_TYPES)
+
+    if 'link_times' in sinks:
+        dispatcher.register('link_times', read_link_times.LinkEventsReader(cursor, batch_size, interning), read_link_times.LinkEventsReader.EVENT_TYPES)
+
+    return dispatcher
+
+if __name__ == '__main__':
+    batch_size = options.pop_option(sys.argv, '--batch-size', DEFAULT_BATCH_SIZE, int)
+    parser = options.pop_option(sys.argv, '--parser', engine.DEFAULT_BACKEND)
+    profile = options.pop_option(sys.argv, '--profile', database.DEFAULT_PROFILE)
+    pipelined = options.pop_flag(sys.argv, '--pipeline')
+    sinks = options.pop_option(sys.argv, '--sinks', ','.join(SINKS)).split(',')
+    interned = options.pop_flag(sys.argv, '--intern')
+
+    if len(sys.argv) < 4:
+        print('ingest_events.py source_xml database suffix [--sinks %s] [--batch-size N] [--parser %s] [--profile %s] [--pipeline] [--intern]' % (','.join(SINKS), '|'.join(engine.BACKENDS), '|'.join(database.PROFILES)))
+        exit()
+
+    if interned and pipelined:
+        print('Interned ids are only written by the sequential mode')
+        exit()
+
+    for sink in sinks:
+        if not sink in SINKS:
+            print('Unknown sink: %s' % sink)
+            exit()
+
+    source = pathlib.Path(sys.argv[1]).resolve()
+    destination = sys.argv[2]
+    suffix = sys.argv[3]
+
+    print('Ingesting events from:')
+    print('    %s' % source)
+    print('')
+
+    print('Will write %s to:' % ', '.join(sinks))
+    print('    %s' % destination)
+    print('')
+
+    connection = database.connect(str(destination), profile, not pipelined)
+    cursor = connection.cursor()
+
+    interning = intern.Interning(cursor, batch_size) if interned else None
+    create_tables(cursor, sinks, suffix, interning)
+
+    print('Reading events ...\n')
+
+    if pipelined:
+        dispatcher = pipeline.run(str(source), connection, lambda writer: make_dispatcher(writer, sinks, batch_size), parser)
+    else:
+        dispatcher = make_dispatcher(cursor, sinks, batch_size, interning)
+
+        with TransparentDecompressionStream.make(str(source)) as f:
+            engine.parse(f, dispatcher, parser)
+
+        if interning is not None:
+            interning.flush()
+
+    connection.commit()
+
+    print('\nFinished dispatching %d events!\n' % dispatcher.count)
+
+    if 'events' in sinks:
+        events_reader = dispatcher.readers['events']
+        print('Read %d events' % events_reader.count)
+        print('Read %d activities (fixed %d start times, %d end times)' % (events_reader.activitycount, events_reader.fixstart, events_reader.fixend))
+        print('Paired %d legs (%d departures without arrival)' % (events_reader.legcount, events_reader.unmatched_departures))
+
+    if 'entered_link' in sinks:
+        entered_link_reader = dispatcher.readers['entered_link']
+        print('Read %d entered link events' % entered_link_reader.count)
+
+    if 'link_times' in sinks:
+        link_times_reader = dispatcher.readers['link_times']
+        print('Read %d link times (inconsistencies: %s)' % (link_times_reader.count, link_times_reader.inconsistent))
+
+    rename_tables(cursor, sinks, suffix)
+
+    connection.commit()
+    database.analyze(connection, table_names(sinks, suffix), profile)
+    connection.close()
@@ -0,0 +1,99 @@
+from writer import BufferedWriter, DEFAULT_BATCH_SIZE
+
+class Interner:
+    """
+        Maps the string ids of one dimension (links, persons, ...) to integers, stored in dim_<dimension>.
+        Existing entries are loaded first, so the same id keeps its integer across runs.
+    """
+
+    def __init__(self, cursor, dimension, batch_size = DEFAULT_BATCH_SIZE):
+        self.table = 'dim_%s' % dimension
+
+        cursor.execute('select name from sqlite_master where type = "table" and name in (?, "links")', (self.table,))
+        existing = [row[0] for row in cursor.fetchall()]
+
+        if not self.table in existing:
+            cursor.execute('create table %s (id integer primary key, name text unique)' % self.table)
+
+            if dimension == 'links' and 'links' in existing:
+                # The network is the link dimension, so interned links join with links.rowid
+                cursor.execute('insert into dim_links (id, name) select rowid, id from links')
+
+        cursor.execute('select id, name from %s' % self.table)
+        self.ids = { name : id for id, name in cursor.fetchall() }
+        self.next = max(self.ids.values(), default = 0) + 1
+
+        self.writer = BufferedWriter(cursor, 'insert into %s (id, name) values (?,?)' % self.table, batch_size)
+
+    def __call__(self, name):
+        if name is None: return None
+
+        id = self.ids.get(name)
+
+        if id is None:
+            id = self.next
+            self.next += 1
+
+            self.ids[name] = id
+            self.writer.append((id, name))
+
+        return id
+
+    def flush(self):
+        self.writer.flush()
+
+class LocalInterner:
+    """
+        Maps the string ids of one dimension to integers for a single run, without writing a dim_<dimension> table.
+        Links get their links.rowid if the network was read into the database, other ids are numbered after them.
+    """
+
+    def __init__(self, cursor = None, dimension = None):
+        self.ids = {}
+
+        if cursor is not None and dimension == 'links':
+            cursor.execute('select name from sqlite_master where type = "table" and name = "links"')
+
+            if cursor.fetchone() is not None:
+                cursor.execute('select rowid, id from links')
+                self.ids = { name : id for id, name in cursor.fetchall() }
+
+        self.next = max(self.ids.values(), default = 0) + 1
+
+    def __call__(self, name):
+        if name is None: return None
+
+        id = self.ids.get(name)
+
+        if id is None:
+            id = self.next
+            self.next += 1
+            self.ids[name] = id
+
+        return id
+
+    def flush(self):
+        pass
+
+class Interning:
+    """ The interners of all dimensions used by the readers of one database. """
+
+    def __init__(self, cursor, batch_size = DEFAULT_BATCH_SIZE):
+        self.cursor = cursor
+        self.batch_size = batch_size
+        self.interners = {}
+
+    def get(self, dimension):
+        if not dimension in self.interners:
+            self.interners[dimension] = Interner(self.cursor, dimension, self.batch_size)
+
+        return self.interners[dimension]
+
+    def flush(self):
+        for interner in self.interners.values():
+            interner.flush()
+
+def types(interning, fields, types, dimensions):
+    """ Column types with interned columns stored as integers. """
+    if interning is None: return types
+    return tuple(['integer' if field in dimensions else type for field, type in zip(fields, types)])
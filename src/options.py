@@ -0,0 +1,22 @@
+def pop_option(argv, name, default = None, type = str):
+    """ Removes '--name value' from argv and returns the converted value (or the default). """
+    if not name in argv:
+        return default
+
+    index = argv.index(name)
+    if index + 1 >= len(argv):
+        print('Missing value for option %s' % name)
+        exit()
+
+    value = argv[index + 1]
+    del argv[index:index + 2]
+
+    return type(value)
+
+def pop_flag(argv, name):
+    """ Removes '--name' from argv and returns whether it was present. """
+    if not name in argv:
+        return False
+
+    argv.remove(name)
+    return True
@@ -0,0 +1,115 @@
+import re
+import pathlib
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+FORMATS = ('sqlite', 'parquet')
+DEFAULT_ROW_GROUP_SIZE = 1000000
+
+INSERT_QUERY = re.compile(r'insert into (\w+) \(([^)]*)\) values')
+
+def arrow_type(type):
+    if type.startswith('integer'): return pyarrow.int64()
+    if type == 'real': return pyarrow.float64()
+    return pyarrow.dictionary(pyarrow.int32(), pyarrow.string())
+
+def convert(values, type):
+    if type.startswith('integer'):
+        return pyarrow.array([None if value is None else int(value) for value in values], pyarrow.int64())
+
+    if type == 'real':
+        return pyarrow.array([None if value is None else float(value) for value in values], pyarrow.float64())
+
+    return pyarrow.array([None if value is None else str(value) for value in values], pyarrow.string()).dictionary_encode()
+
+class ParquetTable:
+    """ Writes the rows of one table to a Parquet file, one row group per row_group_size rows. """
+
+    def __init__(self, path, fields, types, row_group_size = DEFAULT_ROW_GROUP_SIZE):
+        self.path = path
+        self.fields = fields
+        self.types = types
+        self.row_group_size = row_group_size
+
+        self.schema = pyarrow.schema([(field, arrow_type(type)) for field, type in zip(fields, types)])
+        self.writer = pyarrow.parquet.ParquetWriter(str(path), self.schema)
+
+        self.columns = { field : [] for field in fields }
+        self.buffered = 0
+        self.count = 0
+
+    def append(self, fields, rows):
+        for field, values in zip(fields, zip(*rows)):
+            self.columns[field].extend(values)
+
+        self.buffered += len(rows)
+
+        if self.buffered >= self.row_group_size:
+            self.flush()
+
+    def flush(self):
+        if self.buffered == 0: return
+
+        arrays = []
+
+        for field, type in zip(self.fields, self.types):
+            values = self.columns[field]
+
+            if len(values) == 0 and type == 'integer primary key':
+                # Not inserted explicitly, so numbered like an SQLite rowid
+                values = range(self.count + 1, self.count + self.buffered + 1)
+            elif len(values) == 0:
+                values = [None] * self.buffered
+
+            arrays.append(convert(values, type))
+
+        self.writer.write_table(pyarrow.Table.from_arrays(arrays, schema = self.schema))
+
+        self.count += self.buffered
+        self.buffered = 0
+        self.columns = { field : [] for field in self.fields }
+
+    def close(self):
+        self.flush()
+        self.writer.close()
+
+class ParquetOutput:
+    """
+        Writes tables as Parquet files into a directory. Stands in for the cursor of a BufferedWriter,
+        so the readers write to it unchanged; the schemas come from the FIELDS / TYPES of the readers.
+    """
+
+    def __init__(self, directory, row_group_size = DEFAULT_ROW_GROUP_SIZE):
+        if pyarrow is None:
+            raise RuntimeError('The parquet output format needs the pyarrow package')
+
+        self.directory = pathlib.Path(directory)
+        self.directory.mkdir(parents = True, exist_ok = True)
+        self.row_group_size = row_group_size
+
+        self.tables = {}
+
+    def create_table(self, table, fields, types):
+        self.tables[table] = ParquetTable(self.directory / ('%s.parquet' % table), fields, types, self.row_group_size)
+
+    def executemany(self, query, rows):
+        match = INSERT_QUERY.match(query)
+        if match is None: raise ValueError('Unsupported query for parquet output: %s' % query)
+
+        table, fields = match.group(1), [field.strip() for field in match.group(2).split(',')]
+        self.tables[table].append(fields, rows)
+
+    def rename(self, table, name):
+        table = self.tables.pop(table)
+        table.close()
+        table.path.rename(self.directory / ('%s.parquet' % name))
+
+    def close(self):
+        for table in self.tables.values():
+            table.close()
+
+        self.tables = {}
@@ -0,0 +1,161 @@
+import sys, shutil, subprocess
+import threading, queue
+import time
+import contextlib
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+import engine
+
+DEFAULT_QUEUE_SIZE = 8
+PIPE_BUFFER = 1 << 20
+
+GZIP_COMMAND = [sys.executable, '-c', 'import gzip, shutil, sys; shutil.copyfileobj(gzip.open(sys.argv[1]), sys.stdout.buffer, %d)' % PIPE_BUFFER]
+
+class DecompressionStage:
+    """ Decompresses a gzip file in a separate process (pigz if available) and exposes the output as a stream. """
+
+    def __init__(self, path):
+        pigz = shutil.which('pigz')
+        command = [pigz, '-dc', path] if pigz is not None else GZIP_COMMAND + [path]
+
+        self.tool = 'pigz' if pigz is not None else 'python gzip'
+        self.process = subprocess.Popen(command, stdout = subprocess.PIPE, bufsize = PIPE_BUFFER)
+        self.wait = 0.0
+
+    def read(self, size = -1):
+        start = time.time()
+        data = self.process.stdout.read(size)
+        self.wait += time.time() - start
+        return data
+
+    def close(self):
+        self.process.stdout.close()
+
+        if self.process.wait() != 0:
+            raise RuntimeError('Decompression with %s failed' % self.tool)
+
+class FileStage:
+    """ Reads an uncompressed file in the parse stage. """
+
+    def __init__(self, path):
+        self.tool = 'none'
+        self.stream = open(path, 'rb')
+        self.wait = 0.0
+
+    def read(self, size = -1):
+        start = time.time()
+        data = self.stream.read(size)
+        self.wait += time.time() - start
+        return data
+
+    def close(self):
+        self.stream.close()
+
+class WriterStage(threading.Thread):
+    """ Runs the batched inserts on a separate thread. Stands in for the cursor of a BufferedWriter. """
+
+    def __init__(self, connection, maxsize = DEFAULT_QUEUE_SIZE):
+        threading.Thread.__init__(self, daemon = True)
+
+        self.cursor = connection.cursor()
+        self.queue = queue.Queue(maxsize)
+
+        self.busy = 0.0
+        self.blocked = 0.0
+        self.batches = 0
+        self.error = None
+
+    def executemany(self, query, rows):
+        # A failed insert stops the parser at its next batch instead of after the whole file
+        if self.error is not None:
+            raise self.error
+
+        start = time.time()
+        self.queue.put((query, rows))
+        self.blocked += time.time() - start
+
+    def run(self):
+        while True:
+            item = self.queue.get()
+            if item is None: return
+            if self.error is not None: continue
+
+            start = time.time()
+
+            try:
+                self.cursor.executemany(*item)
+            except Exception as error:
+                self.error = error
+
+            self.busy += time.time() - start
+            self.batches += 1
+
+    def close(self):
+        self.queue.put(None)
+        self.join()
+
+        if self.error is not None:
+            raise self.error
+
+def children_cpu_time():
+    if resource is None: return None
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+def run(path, connection, make_reader, backend = engine.DEFAULT_BACKEND, maxsize = DEFAULT_QUEUE_SIZE):
+    """
+        Parses the file with decompression, parsing and writing on separate cores.
+
+        The connection must be opened with check_same_thread = False. make_reader
+        gets the cursor stand-in of the writer stage and returns the handler.
+    """
+    writer = WriterStage(connection, maxsize)
+    writer.start()
+
+    reader = make_reader(writer)
+
+    cpu_before = children_cpu_time()
+    start = time.time()
+
+    stream = DecompressionStage(path) if path.endswith('.gz') else FileStage(path)
+
+    try:
+        engine.parse(stream, reader, backend)
+    except BaseException:
+        # The stages fail as a consequence of the aborted parse (e.g. pigz on a closed pipe), so its error is reported
+        with contextlib.suppress(Exception):
+            stream.close()
+
+        with contextlib.suppress(Exception):
+            writer.close()
+
+        raise
+
+    try:
+        stream.close()
+    finally:
+        writer.close()
+
+    total = time.time() - start
+    parse = total - stream.wait - writer.blocked
+
+    print('\nPipeline stage timings (%.1fs total):' % total)
+
+    if stream.tool != 'none':
+        cpu_after = children_cpu_time()
+        cpu = '%.1fs cpu' % (cpu_after - cpu_before) if cpu_before is not None else 'cpu n/a'
+        print('    decompression (%s): %s, parser waited %.1fs for input' % (stream.tool, cpu, stream.wait))
+    else:
+        print('    reading: parser waited %.1fs for input' % stream.wait)
+
+    print('    parsing: %.1fs busy' % parse)
+    print('    writing: %.1fs busy on %d batches, parser waited %.1fs on a full queue' % (writer.busy, writer.batches, writer.blocked))
+
+    stages = [('decompression', stream.wait), ('parsing', parse), ('writing', writer.blocked)]
+    print('    bottleneck: %s\n' % max(stages, key = lambda stage: stage[1])[0])
+
+    return reader
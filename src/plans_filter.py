@@ -0,0 +1,88 @@
+import gzip
+import re
+
+from chunks import CHUNK_SIZE, ChunkStream
+
+PLAN_TAG = b'<plan'
+PLAN_END_TAG = b'</plan>'
+
+UNSELECTED = re.compile(rb'\sselected\s*=\s*["\']no["\']')
+
+def drop_unselected_plans(chunks):
+    """
+        Removes every <plan selected="no"> element, with everything in it, from a stream of XML chunks.
+        Only the plan start tags are looked at, the rest is searched for with bytes.find, so the parser
+        never sees the elements of unselected plans at all.
+    """
+    buffer = b''
+    skipping = False
+
+    for chunk in chunks:
+        buffer += chunk
+        output = []
+        position = 0
+
+        while True:
+            if skipping:
+                end = buffer.find(PLAN_END_TAG, position)
+
+                if end < 0:
+                    # The end tag may be cut by the chunk boundary
+                    position = max(position, len(buffer) - len(PLAN_END_TAG) + 1)
+                    break
+
+                position = end + len(PLAN_END_TAG)
+                skipping = False
+
+            start = buffer.find(PLAN_TAG, position)
+
+            if start < 0:
+                keep = max(position, len(buffer) - len(PLAN_TAG) + 1)
+                output.append(buffer[position:keep])
+                position = keep
+                break
+
+            end = buffer.find(b'>', start)
+
+            if end < 0:
+                output.append(buffer[position:start])
+                position = start
+                break
+
+            tag = buffer[start:end + 1]
+
+            if not tag[len(PLAN_TAG):len(PLAN_TAG) + 1] in (b' ', b'\t', b'\r', b'\n', b'>', b'/') or UNSELECTED.search(tag) is None:
+                # Another element starting with <plan, or a selected plan
+                output.append(buffer[position:end + 1])
+            else:
+                output.append(buffer[position:start])
+                skipping = not tag.endswith(b'/>')
+
+            position = end + 1
+
+        buffer = buffer[position:]
+
+        if len(output) > 0:
+            yield b''.join(output)
+
+    if not skipping and len(buffer) > 0:
+        yield buffer
+
+class SelectedPlansStream(ChunkStream):
+    """ File-like view on a plans file without its unselected plans, for the parser backends. Line numbers no longer match the file. """
+
+    def __init__(self, stream, chunk_size = CHUNK_SIZE):
+        self.stream = stream
+        ChunkStream.__init__(self, iter(lambda: stream.read(chunk_size), b''))
+
+    def wrap(self, chunks):
+        return drop_unselected_plans(chunks)
+
+    def close(self):
+        ChunkStream.close(self)
+        self.stream.close()
+
+def open_plans(path, selected = True):
+    """ Opens a (gzipped) plans file for parsing, by default with only the selected plans left in. """
+    stream = gzip.open(path) if path.endswith('.gz') else open(path, 'rb')
+    return SelectedPlansStream(stream) if selected else stream
@@ -1,18 +1,29 @@
-import gzip
 import xml.sax
 import numpy as np
 import pathlib
-import sys, sqlite3
+import sys
 import time
 
+import options
+import engine, plans_filter
+import database, intern, convert
+from writer import BufferedWriter, DEFAULT_BATCH_SIZE, make_insert_query, make_create_query
+
 class DistancesReader(xml.sax.ContentHandler):
-    def __init__(self, cursor):
+    FIELDS = ('person', 'mode', 'departure_time', 'arrival_time', 'distance')
+    TYPES = ('text', 'text', 'real', 'real', 'real')
+
+    DIMENSIONS = { 'person' : 'persons', 'mode' : 'modes' }
+
+    def __init__(self, cursor, batch_size = DEFAULT_BATCH_SIZE, interning = None):
         self.reset()
 
         self.display = time.time()
         self.count = 0
+        self.missing_routes = 0
 
         self.cursor = cursor
+        self.writer = BufferedWriter(cursor, make_insert_query('_distances', DistancesReader.FIELDS), batch_size, convert.converters(DistancesReader.FIELDS, DistancesReader.TYPES, interning, DistancesReader.DIMENSIONS))
 
     def reset(self):
         self.person = None
@@ -28,21 +39,21 @@ class DistancesReader(xml.sax.ContentHandler):
         elif name == 'leg' and self.selected:
             self.leg = (
                     attributes['mode'],
-                    float(np.dot(np.array([int(d) for d in attributes['dep_time'].split(':')]), np.array([3600, 60, 1]))),
-                    float(np.dot(np.array([int(d) for d in attributes['arr_time'].split(':')]), np.array([3600, 60, 1])))
+                    convert.parse_time(attributes['dep_time']),
+                    convert.parse_time(attributes['arr_time'])
                 )
         elif name == 'route' and self.leg is not None:
             self.route = attributes['distance']
 
     def endElement(self, name):
-        if name == 'leg' and self.leg is None:
-            print('Leg without a route... are you using the experienced plans file?')
-            self.leg = None
-        elif name == 'leg':
+        if name == 'leg' and self.leg is not None:
             mode, departure_time, arrival_time = self.leg
             distance = self.route
 
-            self.cursor.execute('insert into _distances (person, mode, departure_time, arrival_time, distance) values (?,?,?,?,?)', (self.person, mode, departure_time, arrival_time, distance))
+            if distance is None:
+                self.missing_routes += 1
+
+            self.writer.append((self.person, mode, departure_time, arrival_time, distance))
 
             self.count += 1
             if self.display + 1.0 < time.time():
@@ -51,12 +62,23 @@ class DistancesReader(xml.sax.ContentHandler):
 
             self.leg = None
             self.route = None
+        elif name == 'plan':
+            self.selected = False
         elif name == 'person':
             self.reset()
 
+    def endDocument(self):
+        self.writer.flush()
+
 if __name__ == '__main__':
+    batch_size = options.pop_option(sys.argv, '--batch-size', DEFAULT_BATCH_SIZE, int)
+    parser = options.pop_option(sys.argv, '--parser', engine.DEFAULT_BACKEND)
+    profile = options.pop_option(sys.argv, '--profile', database.DEFAULT_PROFILE)
+    interned = options.pop_flag(sys.argv, '--intern')
+    selected = not options.pop_flag(sys.argv, '--no-filter')
+
     if len(sys.argv) < 4:
-        print('read_distances.py source_xml suffix')
+        print('read_distances.py source_xml database suffix [--batch-size N] [--parser %s] [--profile %s] [--intern] [--no-filter]' % ('|'.join(engine.BACKENDS), '|'.join(database.PROFILES)))
         exit()
 
     source = pathlib.Path(sys.argv[1]).resolve()
@@ -73,26 +95,32 @@ if __name__ == '__main__':
     print('    %s ' % destination)
     print('')
 
-    connection = sqlite3.connect(str(destination))
+    connection = database.connect(str(destination), profile)
     cursor = connection.cursor()
 
-    cursor.execute('create table _distances (person text, mode text, departure_time real, arrival_time real, distance real)')
+    interning = intern.Interning(cursor, batch_size) if interned else None
+
+    types = intern.types(interning, DistancesReader.FIELDS, DistancesReader.TYPES, DistancesReader.DIMENSIONS)
+    cursor.execute(make_create_query('_distances', DistancesReader.FIELDS, types))
 
     print('Reading distnaces ...\n')
 
-    reader = DistancesReader(cursor)
+    reader = DistancesReader(cursor, batch_size, interning)
 
-    if str(source)[-2:] == 'gz':
-        with gzip.open(str(source)) as f:
-            xml.sax.parse(f, reader)
-    else:
-        with open(str(source)) as f:
-            xml.sax.parse(f, reader)
+    with plans_filter.open_plans(str(source), selected) as f:
+        engine.parse(f, reader, parser)
+
+    if interning is not None:
+        interning.flush()
 
     connection.commit()
     print('\nFinished reading %d distances!\n' % reader.count)
 
+    if reader.missing_routes > 0:
+        print('%d legs without a route... are you using the experienced plans file?\n' % reader.missing_routes)
+
     cursor.execute('alter table _distances rename to %s' % table)
     connection.commit()
 
+    database.analyze(connection, ['distances_%s' % suffix], profile)
     connection.close()
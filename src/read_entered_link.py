@@ -1,36 +1,52 @@
 import gzip
 import xml.sax
-import sys, sqlite3
+import sys
+import numpy as np
 import time
 import functools
 
+import options
+import engine, pipeline
+import database, intern, convert
+from writer import BufferedWriter, DEFAULT_BATCH_SIZE, make_insert_query, make_create_query
+from aggregate import LinkVolumes, DEFAULT_VOLUME_BIN_SIZE
+
 class TransparentDecompressionStream:
 	@staticmethod
 	def make(file_name):
 		if file_name.endswith('.gz'):
 			stream = gzip.open(file_name)
 		else:
-			stream = open(file_name)
+			stream = open(file_name, 'rb')
 
 		return stream
 
 class EventsReader(xml.sax.ContentHandler):
+	EVENT_TYPES = ('entered link',)
+
 	ATTRIBUTES = ('event_id', 'time', 'type', 'link', 'vehicle', 'legMode')
 	TYPES = ('integer primary key', 'real', 'text', 'text', 'text', 'text')
 
-	def __init__(self, cursor):
+	DIMENSIONS = { 'link' : 'links', 'vehicle' : 'vehicles', 'legMode' : 'modes' }
+
+	def __init__(self, cursor, batch_size = DEFAULT_BATCH_SIZE, table = 'events', interning = None, volumes = None, raw = True):
 		self.cursor = cursor
 		self.display = time.time()
 		self.count = 0
 
+		self.volumes = volumes
+		self.raw = raw
+
+		self.writer = None if not raw else BufferedWriter(cursor, EventsReader.make_query(table), batch_size, convert.converters(EventsReader.ATTRIBUTES, EventsReader.TYPES, interning, EventsReader.DIMENSIONS))
+
 	def get_values(self, attributes):
 		return [(attributes[attr] if attr in attributes else None) for attr in EventsReader.ATTRIBUTES]
 
 	@staticmethod
-	def make_type_fields():
+	def make_type_fields(types = TYPES):
 		return ', '.join([
 			'%s %s' % (name, type_)
-			for type_, name in zip(EventsReader.TYPES, EventsReader.ATTRIBUTES)])
+			for type_, name in zip(types, EventsReader.ATTRIBUTES)])
 
 	@staticmethod
 	def make_fields():
@@ -41,19 +57,24 @@ class EventsReader(xml.sax.ContentHandler):
 		return ', '.join(['?'] * len(EventsReader.ATTRIBUTES))
 
 	@staticmethod
-	@functools.lru_cache(maxsize=1)
-	def make_query():
+	@functools.lru_cache(maxsize=4)
+	def make_query(table = 'events'):
 		fields = EventsReader.make_fields()
 		values = EventsReader.make_values()
 
-		query = 'insert into _events (%s) values (%s)' % (fields, values)
+		query = 'insert into _%s (%s) values (%s)' % (table, fields, values)
 		return query
 
 	def startElement(self, name, attributes):
 		if not name == 'event': return
-		if not attributes['type'] in ['entered link']: return
+		if not attributes['type'] in EventsReader.EVENT_TYPES: return
+
+		if self.raw:
+			self.writer.append(self.get_values(attributes))
+
+		if self.volumes is not None:
+			self.volumes.add(attributes['link'], attributes.get('legMode'), float(attributes['time']))
 
-		self.cursor.execute(EventsReader.make_query(), self.get_values(attributes))
 		self.count += 1
 
 		if (self.count % 1000) == 0:
@@ -61,9 +82,84 @@ class EventsReader(xml.sax.ContentHandler):
 				print('   Read %d events ...' % self.count)
 				self.display = time.time()
 
+	def endDocument(self):
+		if self.raw:
+			self.writer.flush()
+
+		if self.volumes is not None:
+			self.volumes.flush()
+
+def create_tables(cursor, suffix, table = 'events', interning = None):
+	types = intern.types(interning, EventsReader.ATTRIBUTES, EventsReader.TYPES, EventsReader.DIMENSIONS)
+
+	cursor.execute('drop table if exists _%s' % table)
+	cursor.execute('drop table if exists %s_%s' % (table, suffix))
+	cursor.execute('create table _%s (%s)' % (table, EventsReader.make_type_fields(types)))
+
+def create_indexes(cursor, suffix, table = 'events'):
+	cursor.execute('create index %s_time_%s on _%s (time)' % (table, suffix, table))
+	cursor.execute('create index %s_link_%s on _%s (link)' % (table, suffix, table))
+
+def rename_tables(cursor, suffix, table = 'events'):
+	cursor.execute('alter table _%s rename to %s_%s' % (table, table, suffix))
+
+def write_volumes(cursor, volumes, suffix, interning = None, batch_size = DEFAULT_BATCH_SIZE):
+	""" Writes the non-zero counts into volumes_<suffix>, with link and mode names unless they are interned. """
+	dimensions = { 'link' : 'links', 'mode' : 'modes' }
+
+	cursor.execute('drop table if exists volumes_%s' % suffix)
+	cursor.execute(make_create_query('volumes_%s' % suffix, LinkVolumes.FIELDS, intern.types(interning, LinkVolumes.FIELDS, LinkVolumes.TYPES, dimensions)))
+
+	if interning is None:
+		names = { id : name for name, id in volumes.link_ids.ids.items() }
+		link = names.get
+		mode = None
+	else:
+		link = None
+		mode = interning.get('modes')
+
+	writer = BufferedWriter(cursor, make_insert_query('volumes_%s' % suffix, LinkVolumes.FIELDS), batch_size, (link, mode, None, None, None))
+
+	for row in volumes.rows():
+		writer.append(row)
+
+	writer.flush()
+
+	if mode is not None:
+		mode.flush()
+
+	cursor.execute('create index volumes_link_%s on volumes_%s (link)' % (suffix, suffix))
+
+	return writer.count
+
 if __name__ == '__main__':
+	batch_size = options.pop_option(sys.argv, '--batch-size', DEFAULT_BATCH_SIZE, int)
+	parser = options.pop_option(sys.argv, '--parser', engine.DEFAULT_BACKEND)
+	profile = options.pop_option(sys.argv, '--profile', database.DEFAULT_PROFILE)
+	pipelined = options.pop_flag(sys.argv, '--pipeline')
+	interned = options.pop_flag(sys.argv, '--intern')
+	counting = options.pop_flag(sys.argv, '--volumes')
+	bin_size = options.pop_option(sys.argv, '--bin-size', DEFAULT_VOLUME_BIN_SIZE, float)
+	npy = options.pop_option(sys.argv, '--npy')
+	raw = not options.pop_flag(sys.argv, '--no-raw')
+
 	if len(sys.argv) < 4:
-		print('read_events.py source_xml database suffix')
+		print('read_entered_link.py source_xml database suffix [--batch-size N] [--parser %s] [--profile %s] [--pipeline] [--intern] [--volumes] [--bin-size seconds] [--npy path] [--no-raw]' % ('|'.join(engine.BACKENDS), '|'.join(database.PROFILES)))
+
+	if interned and pipelined:
+		print('Interned ids are only written by the sequential mode')
+		exit()
+
+	if npy is not None:
+		counting = True
+
+	if counting and pipelined:
+		print('Volumes are only counted by the sequential mode')
+		exit()
+
+	if not raw and not counting:
+		print('Without raw events, --volumes is needed to write anything')
+		exit()
 
 	source = sys.argv[1]
 	destination = sys.argv[2]
@@ -77,44 +173,66 @@ if __name__ == '__main__':
 	print('	%s' % destination)
 	print('')
 
-	table = 'events'
-	temp_table = '_%s' % table
-	final_table = '%s_%s' % (table, suffix)
-
-	connection = sqlite3.connect(str(destination))  # @UndefinedVariable
+	connection = database.connect(str(destination), profile, not pipelined)  # @UndefinedVariable
 	connection.isolation_level = "EXCLUSIVE"
 	cursor = connection.cursor()
 
-	cursor.execute('drop table if exists %s' % temp_table)
-	cursor.execute('drop table if exists %s' % final_table)
-	cursor.execute('create table %s (%s)' % (temp_table, EventsReader.make_type_fields()))
+	interning = intern.Interning(cursor, batch_size) if interned else None
+
+	if raw:
+		create_tables(cursor, suffix, interning = interning)
+
+	# The volume matrix is indexed by integer link ids, without --intern they are only kept in memory
+	link_ids = interning.get('links') if interning is not None else intern.LocalInterner(cursor, 'links')
+	volumes = LinkVolumes(link_ids, bin_size) if counting else None
 
 	print('Reading events ...\n')
 
-	reader = EventsReader(cursor)
-	with TransparentDecompressionStream.make(str(source)) as f:
-		xml.sax.parse(f, reader)
+	if pipelined:
+		reader = pipeline.run(str(source), connection, lambda writer: EventsReader(writer, batch_size), parser)
+	else:
+		reader = EventsReader(cursor, batch_size, interning = interning, volumes = volumes, raw = raw)
+		with TransparentDecompressionStream.make(str(source)) as f:
+			engine.parse(f, reader, parser)
+
+		if interning is not None:
+			interning.flush()
+
+		if volumes is not None:
+			volumes.link_ids.flush()
 
 	connection.commit()
 
 	print('\nFinished reading %d events!\n' % reader.count)
 
-	cursor.execute('create index %s_time_%s on _events (time)' % (table, suffix))
-	cursor.execute('create index %s_link_%s on _events (link)' % (table, suffix))
-	connection.commit()
+	tables = []
+
+	if volumes is not None:
+		count = write_volumes(cursor, volumes, suffix, interning, batch_size)
+		connection.commit()
+		tables.append('volumes_%s' % suffix)
+
+		print('Counted volumes of %d links, %d modes and %d time bins into %d rows\n' % (volumes.link_count, len(volumes.mode_names), volumes.bin_count, count))
+
+		if npy is not None:
+			np.save(npy, volumes.matrix())
+			print('Wrote the volume matrix [link id - 1, mode, bin] for modes %s to %s\n' % (', '.join([str(mode) for mode in volumes.mode_names]), npy))
 
-	print('\nFinished creating indexes!\n')
+	if raw:
+		create_indexes(cursor, suffix)
+		connection.commit()
 
-	cursor.execute('select min(time), max(time) from _events')
-	[sim_start_time, sim_end_time] = cursor.fetchone()
+		print('\nFinished creating indexes!\n')
 
-	print('Simulation start time: %f' % sim_start_time)
-	print('Simulation end time: %f\n' % sim_end_time)
+		cursor.execute('select min(time), max(time) from _events')
+		[sim_start_time, sim_end_time] = cursor.fetchone()
 
-	tables = ['events']
+		print('Simulation start time: %f' % sim_start_time)
+		print('Simulation end time: %f\n' % sim_end_time)
 
-	for table in tables:
-		cursor.execute('alter table _%s rename to %s_%s' % (table, table, suffix))
+		rename_tables(cursor, suffix)
+		tables.append('events_%s' % suffix)
 
 	connection.commit()
+	database.analyze(connection, tables, profile)
 	connection.close()
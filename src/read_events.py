@@ -2,18 +2,63 @@ import gzip
 import xml.sax
 import numpy as np
 import pathlib
-import sys, sqlite3
+import sys
 import time
+import re
+
+import options
+import engine, pipeline, output
+import database, intern, convert, checkpoint, index_events
+from writer import BufferedWriter, DEFAULT_BATCH_SIZE, make_insert_query, make_create_query
 
 class EventsReader(xml.sax.ContentHandler):
+	EVENT_TYPES = ('actstart', 'actend', 'arrival', 'departure', 'AVDispatchModeChange')
+
 	ATTRIBUTES = ('event_id', 'time', 'type', 'person', 'link', 'actType', 'vehicle', 'legMode')
 	TYPES = ('integer primary key', 'real', 'text', 'text', 'text', 'text', 'text', 'text')
 
-	def __init__(self, cursor):
+	ACTIVITY_FIELDS = ('activity_id', 'person', 'start_id', 'end_id', 'start_time', 'end_time', 'link', 'act_type')
+	ACTIVITY_TYPES = ('integer primary key', 'text', 'integer', 'integer', 'real', 'real', 'text', 'text')
+
+	LEG_FIELDS = ('person', 'departure_time', 'arrival_time', 'mode', 'departure_link', 'arrival_link')
+	LEG_TYPES = ('text', 'real', 'real', 'text', 'text', 'text')
+
+	TABLES = (('events', ATTRIBUTES, TYPES), ('activities', ACTIVITY_FIELDS, ACTIVITY_TYPES), ('legs', LEG_FIELDS, LEG_TYPES))
+
+	DIMENSIONS = {
+		'person' : 'persons', 'link' : 'links', 'vehicle' : 'vehicles', 'legMode' : 'modes',
+		'mode' : 'modes', 'departure_link' : 'links', 'arrival_link' : 'links' }
+
+	# Pairing state and counters that are stored with each checkpoint
+	CHECKPOINT_STATE = (
+		'count', 'start_time', 'end_time', 'departures', 'legcount', 'unmatched_departures',
+		'currentActivity', 'activitycount', 'fixstart', 'fixend')
+
+	# Persons with letters in their id (e.g. AV drivers) do not contribute legs
+	NON_AGENT = re.compile('[a-zA-Z]')
+
+	def __init__(self, cursor, batch_size = DEFAULT_BATCH_SIZE, interning = None):
 		self.cursor = cursor
 		self.display = time.time()
 		self.count = 0
 
+		self.writer = BufferedWriter(cursor, EventsReader.make_query(), batch_size, convert.converters(EventsReader.ATTRIBUTES, EventsReader.TYPES, interning, EventsReader.DIMENSIONS))
+		self.legs = BufferedWriter(cursor, make_insert_query('_legs', EventsReader.LEG_FIELDS), batch_size, convert.converters(EventsReader.LEG_FIELDS, EventsReader.LEG_TYPES, interning, EventsReader.DIMENSIONS))
+
+		self.departures = {}
+		self.legcount = 0
+		self.unmatched_departures = 0
+
+		self.activities = BufferedWriter(cursor, make_insert_query('_activities', EventsReader.ACTIVITY_FIELDS[1:]), batch_size, convert.converters(EventsReader.ACTIVITY_FIELDS[1:], EventsReader.ACTIVITY_TYPES[1:], interning, EventsReader.DIMENSIONS))
+
+		self.currentActivity = {}
+		self.activitycount = 0
+		self.fixstart = 0
+		self.fixend = 0
+
+		self.start_time = None
+		self.end_time = None
+
 	def get_values(self, attributes):
 		values = []
 		for attr in EventsReader.ATTRIBUTES:
@@ -31,24 +76,144 @@ class EventsReader(xml.sax.ContentHandler):
 	def make_values():
 		return ', '.join(['?'] * len(EventsReader.ATTRIBUTES))
 
+	def make_query():
+		return 'insert into _events (%s) values (%s)' % (EventsReader.make_fields(), EventsReader.make_values())
+
 	def startElement(self, name, attributes):
 		if not name == 'event': return
-		if not attributes['type'] in ['actstart', 'actend', 'arrival', 'departure', 'AVDispatchModeChange']: return
+		if not attributes['type'] in EventsReader.EVENT_TYPES: return
 
-		fields = EventsReader.make_fields()
-		values = EventsReader.make_values()
-
-		query = 'insert into _events (%s) values (%s)' % (fields, values)
-		self.cursor.execute(query, self.get_values(attributes))
 		self.count += 1
+		event_id = self.count
+
+		values = self.get_values(attributes)
+		values[0] = event_id
+		self.writer.append(values)
+
+		etime = float(attributes['time'])
+		if self.start_time is None or etime < self.start_time: self.start_time = etime
+		if self.end_time is None or etime > self.end_time: self.end_time = etime
+
+		type = attributes['type']
+		if type == 'departure':
+			self.departure(attributes)
+		elif type == 'arrival':
+			self.arrival(attributes)
+		elif type == 'actstart':
+			self.activity_start(event_id, etime, attributes)
+		elif type == 'actend':
+			self.activity_end(event_id, etime, attributes)
 
 		if self.display + 1.0 < time.time():
 			print('   Read %d events ...' % self.count)
 			self.display = time.time()
 
+	def departure(self, attributes):
+		person = attributes['person']
+		if EventsReader.NON_AGENT.search(person) is not None: return
+
+		if person in self.departures:
+			self.unmatched_departures += 1
+
+		self.departures[person] = (attributes['time'], attributes['legMode'], attributes['link'])
+
+	def arrival(self, attributes):
+		person = attributes['person']
+		if not person in self.departures: return
+
+		departure_time, mode, departure_link = self.departures[person]
+		if mode != attributes['legMode']: return
+
+		del self.departures[person]
+		self.legs.append((person, departure_time, attributes['time'], mode, departure_link, attributes['link']))
+		self.legcount += 1
+
+	def activity_start(self, event_id, etime, attributes):
+		self.currentActivity[attributes['person']] = (event_id, etime, attributes['link'], attributes['actType'])
+
+	def activity_end(self, event_id, etime, attributes):
+		person = attributes['person']
+
+		if person in self.currentActivity:
+			start_id, start_time, link, act_type = self.currentActivity.pop(person)
+		else:
+			# Events are ordered by time, so the first event seen gives the simulation start time
+			start_id, start_time, link, act_type = None, self.start_time, attributes['link'], attributes['actType']
+			self.fixstart += 1
+
+		self.activities.append((person, start_id, event_id, start_time, etime, link, act_type))
+		self.activitycount += 1
+
+	def endDocument(self):
+		self.unmatched_departures += len(self.departures)
+		self.departures.clear()
+
+		# Activities still open are written in the order of their start events
+		for person, activity in sorted(self.currentActivity.items(), key = lambda item: item[1][0]):
+			start_id, start_time, link, act_type = activity
+			self.activities.append((person, start_id, None, start_time, self.end_time, link, act_type))
+			self.activitycount += 1
+			self.fixend += 1
+
+		self.currentActivity.clear()
+		self.flush()
+
+	def flush(self):
+		self.writer.flush()
+		self.legs.flush()
+		self.activities.flush()
+
+def create_tables(cursor, interning = None):
+	for table, fields, types in EventsReader.TABLES:
+		# Left over by an interrupted run
+		cursor.execute('drop table if exists _%s' % table)
+		cursor.execute(make_create_query('_%s' % table, fields, intern.types(interning, fields, types, EventsReader.DIMENSIONS)))
+
+def rename_tables(cursor, suffix):
+	tables = ['events', 'activities', 'legs']
+
+	for table in tables:
+		cursor.execute('alter table _%s rename to %s_%s' % (table, table, suffix))
+
 if __name__ == '__main__':
+    batch_size = options.pop_option(sys.argv, '--batch-size', DEFAULT_BATCH_SIZE, int)
+    parser = options.pop_option(sys.argv, '--parser', engine.DEFAULT_BACKEND)
+    profile = options.pop_option(sys.argv, '--profile', database.DEFAULT_PROFILE)
+    pipelined = options.pop_flag(sys.argv, '--pipeline')
+    output_format = options.pop_option(sys.argv, '--format', 'sqlite')
+    interned = options.pop_flag(sys.argv, '--intern')
+    interval = options.pop_option(sys.argv, '--checkpoint', 0, int)
+    resume = options.pop_flag(sys.argv, '--resume')
+    from_time = options.pop_option(sys.argv, '--from-time', None, convert.parse_seconds)
+    to_time = options.pop_option(sys.argv, '--to-time', None, convert.parse_seconds)
+    windowed = from_time is not None or to_time is not None
+
     if len(sys.argv) < 4:
-        print('read_events.py source_xml database suffix')
+        print('read_events.py source_xml database suffix [--batch-size N] [--parser %s] [--profile %s] [--pipeline] [--format %s] [--intern] [--checkpoint N] [--resume] [--from-time T] [--to-time T]' % ('|'.join(engine.BACKENDS), '|'.join(database.PROFILES), '|'.join(output.FORMATS)))
+        exit()
+
+    if windowed and (pipelined or resume or interval > 0):
+        print('Time windows are only read by the sequential mode without checkpoints')
+        exit()
+
+    if resume and interval == 0:
+        interval = checkpoint.DEFAULT_INTERVAL
+
+    if interval > 0 and (pipelined or output_format == 'parquet' or parser != 'expat'):
+        print('Checkpoints are only written by the sequential SQLite mode with the expat parser')
+        exit()
+
+    if interval > 0 and profile == 'bulk':
+        print('Checkpoints need a journal, using the wal profile\n')
+        profile = 'wal'
+
+    if output_format == 'parquet' and pipelined:
+        print('The pipelined mode only writes to SQLite')
+        exit()
+
+    if interned and (pipelined or output_format == 'parquet'):
+        print('Interned ids are only written by the sequential SQLite mode')
+        exit()
 
     source = pathlib.Path(sys.argv[1]).resolve()
     destination = sys.argv[2]
@@ -62,112 +227,64 @@ if __name__ == '__main__':
     print('    %s' % destination)
     print('')
 
-    connection = sqlite3.connect(str(destination))
-    cursor = connection.cursor()
-
-    cursor.execute('create table _events (%s)' % EventsReader.make_type_fields())
-    cursor.execute("""
-    	create table _activities (
-    		activity_id integer primary key,
-            person text,
-    		start_id integer,
-    		end_id integer,
-    		start_time real,
-    		end_time real,
-    		link text,
-    		act_type text)""")
-
-    print('Reading events ...\n')
-
-    reader = EventsReader(cursor)
-    with gzip.open(str(source)) as f:
-    	xml.sax.parse(f, reader)
-
-    connection.commit()
-
-    print('\nFinished reading %d events!\n' % reader.count)
-
-    cursor.execute('select min(time) from _events')
-    sim_start_time = cursor.fetchone()[0]
-
-    cursor.execute('select max(time) from _events')
-    sim_end_time = cursor.fetchone()[0]
+    if output_format == 'parquet':
+        cursor = output.ParquetOutput(destination)
 
-    print('Simulation start time: %f' % sim_start_time)
-    print('Simulation end time: %f\n' % sim_end_time)
+        for table, fields, types in EventsReader.TABLES:
+            cursor.create_table('_%s' % table, fields, types)
+    else:
+        connection = database.connect(str(destination), profile, not pipelined)
+        cursor = connection.cursor()
 
-    print('Indexing activities ...')
+    interning = intern.Interning(cursor, batch_size) if interned else None
 
-    currentActivity = {}
-    writecursor = connection.cursor()
+    checkpoints = checkpoint.Checkpoints(cursor, 'events_%s' % suffix, source) if interval > 0 else None
+    resumed = checkpoints.load() if resume else None
 
-    fixstart = 0
-    fixend = 0
+    if output_format == 'sqlite' and resumed is None:
+        create_tables(cursor, interning)
 
-    display = time.time()
-    count = 0
-
-    for row in cursor.execute('select * from _events where type in ("actstart","actend") order by time asc'):
-    	event_id, etime, type, person, link, act_type = row[:6]
-
-    	if type == 'actstart':
-    		currentActivity[person] = (event_id, etime, link, act_type)
-    	elif type == 'actend':
-    		start_id, start_time = None, sim_start_time
-
-    		if person in currentActivity:
-    			start_id, start_time, link, act_type = currentActivity[person]
-    			del currentActivity[person]
-    		else:
-    			fixstart += 1
-
-    		writecursor.execute('insert into _activities (person, start_id, end_id, start_time, end_time, link, act_type) values (?,?,?,?,?,?,?)',
-    			(person, start_id, event_id, start_time, etime, link, act_type))
+    print('Reading events ...\n')
 
-    	count += 1
-    	if display + 1.0 < time.time():
-    		print('    Processed %d acivities ...' % count)
-    		display = time.time()
+    if pipelined:
+        reader = pipeline.run(str(source), connection, lambda writer: EventsReader(writer, batch_size), parser)
+    else:
+        reader = EventsReader(cursor, batch_size, interning)
 
-    for person, activity in currentActivity.items():
-    	start_id, start_time, link, act_type = activity
-    	fixend += 1
-    	writecursor.execute('insert into _activities (person, start_id, end_id, start_time, end_time, link, act_type) values (?,?,?,?,?,?,?)',
-    		(person, start_id, None, start_time, sim_end_time, link, act_type))
+        if checkpoints is not None:
+            checkpoint.parse(str(source), reader, connection, checkpoints, interval, resumed, interning)
+        elif windowed:
+            with index_events.open_window(str(source), from_time, to_time) as f:
+                engine.parse(f, index_events.TimeWindowHandler(reader, from_time, to_time), parser)
+        else:
+            with gzip.open(str(source)) as f:
+                engine.parse(f, reader, parser)
 
-    connection.commit()
+        if interning is not None:
+            interning.flush()
 
-    print('\nFixed %d activity start times' % fixstart)
-    print('Fixed %d activity end times\n\n' % fixend)
+    print('\nFinished reading %d events!\n' % reader.count)
+    print('Simulation start time: %f' % reader.start_time)
+    print('Simulation end time: %f\n' % reader.end_time)
 
-    print('Reading legs from the database...')
+    print('Read %d activities' % reader.activitycount)
+    print('Fixed %d activity start times' % reader.fixstart)
+    print('Fixed %d activity end times\n' % reader.fixend)
 
-    result = cursor.execute("""
-        create table _legs as
-        select
-            de.person,
-            de.time as departure_time,
-            min(ae.time) as arrival_time,
-            de.legMode as mode,
-            de.link as departure_link,
-            ae.link as arrival_link
-        from _events as de
-        left join _events as ae on de.person = ae.person
-        where
-            de.type = "departure" and ae.type = "arrival" and
-            ae.legMode = de.legMode and
-            ae.time >= de.time and
-            de.person not glob '*[a-zA-Z]*'
-        group by de.event_id
-    """)
+    print('Paired %d legs (%d departures without arrival)\n' % (reader.legcount, reader.unmatched_departures))
 
-    print('Done!')
-    connection.commit()
+    if output_format == 'parquet':
+        for table, fields, types in EventsReader.TABLES:
+            cursor.rename('_%s' % table, '%s_%s' % (table, suffix))
 
-    tables = ['events', 'activities', 'legs']
+        cursor.close()
+    else:
+        connection.commit()
+        rename_tables(cursor, suffix)
 
-    for table in tables:
-        cursor.execute('alter table _%s rename to %s_%s' % (table, table, suffix))
+        if checkpoints is not None:
+            checkpoints.clear()
 
-    connection.commit()
-    connection.close()
+        connection.commit()
+        database.analyze(connection, ['%s_%s' % (table, suffix) for table, fields, types in EventsReader.TABLES], profile)
+        connection.close()
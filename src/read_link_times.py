@@ -2,23 +2,46 @@ import gzip
 import xml.sax
 import numpy as np
 import pathlib
-import sys, sqlite3
+import sys
 import time
 
+import options
+import engine, pipeline
+import database, intern, convert, checkpoint, index_events
+from tracking import VehicleTable
+from aggregate import LinkStatistics, DEFAULT_BIN_SIZE
+from writer import BufferedWriter, DEFAULT_BATCH_SIZE, make_insert_query, make_create_query
+
 class LinkEventsReader(xml.sax.ContentHandler):
-    def __init__(self, cursor):
+    EVENT_TYPES = ('entered link', 'left link')
+
+    FIELDS = ('link', 'enter_time', 'leave_time')
+    TYPES = ('text', 'real', 'real')
+
+    DIMENSIONS = { 'link' : 'links' }
+
+    CHECKPOINT_STATE = ('count', 'inconsistent', 'vehicles', 'statistics')
+
+    def __init__(self, cursor, batch_size = DEFAULT_BATCH_SIZE, interning = None, statistics = None, raw = True):
         self.cursor = cursor
         self.display = time.time()
 
+        self.raw = raw
+        self.writer = BufferedWriter(cursor, make_insert_query('_linktimes', LinkEventsReader.FIELDS), batch_size, convert.converters(LinkEventsReader.FIELDS, LinkEventsReader.TYPES, interning, LinkEventsReader.DIMENSIONS))
+
+        # Optional LinkStatistics, written to _linkstats at the end of the document
+        self.statistics = statistics
+        self.statistics_writer = BufferedWriter(cursor, make_insert_query('_linkstats', LinkStatistics.FIELDS), batch_size, convert.converters(LinkStatistics.FIELDS, LinkStatistics.TYPES, interning, LinkEventsReader.DIMENSIONS))
+
         self.count = 0
         self.inconsistent = [0, 0, 0]
 
-        self.vehicles = {}
+        self.vehicles = VehicleTable()
 
     def startElement(self, name, attributes):
         if not 'type' in attributes: return
         type = attributes['type']
-        if not type in ['entered link', 'left link']: return
+        if not type in LinkEventsReader.EVENT_TYPES: return
 
         type = attributes['type']
         timestamp = attributes['time']
@@ -30,31 +53,107 @@ class LinkEventsReader(xml.sax.ContentHandler):
             self.display = time.time()
 
         if type == 'entered link':
-            if vehicle in self.vehicles:
+            if not self.vehicles.add(vehicle, link, timestamp):
                 self.inconsistent[0] += 1
                 return
 
-            self.vehicles[vehicle] = (link, timestamp)
-
         elif type == 'left link':
-            if not vehicle in self.vehicles:
+            entry = self.vehicles.pop(vehicle)
+
+            if entry is None:
                 # This is not really an inconsistency, it just means the vehicle was parked
                 # self.inconsistent[1] += 1
                 return
 
-            start_link, start_time = self.vehicles[vehicle]
+            start_link, start_time = entry
             if start_link != link:
                 self.inconsistent[2] += 1
-                del self.vehicles[vehicle]
                 return
 
-            cursor.execute('insert into _linktimes (link, enter_time, leave_time) values (?,?,?)', (start_link, start_time, timestamp))
+            if self.raw:
+                self.writer.append((start_link, start_time, timestamp))
+
+            if self.statistics is not None:
+                self.statistics.add(start_link, start_time, float(timestamp))
+
             self.count += 1
-            del self.vehicles[vehicle]
+
+    def endDocument(self):
+        self.flush()
+
+        if self.statistics is not None:
+            for row in self.statistics.rows():
+                self.statistics_writer.append(row)
+
+            self.statistics_writer.flush()
+
+    def flush(self):
+        self.writer.flush()
+
+def create_tables(cursor, interning = None, raw = True, statistics = False):
+    # Left over by an interrupted run
+    cursor.execute('drop table if exists _linktimes')
+    cursor.execute('drop table if exists _linkstats')
+
+    if raw:
+        types = intern.types(interning, LinkEventsReader.FIELDS, LinkEventsReader.TYPES, LinkEventsReader.DIMENSIONS)
+        cursor.execute(make_create_query('_linktimes', LinkEventsReader.FIELDS, types))
+
+    if statistics:
+        types = intern.types(interning, LinkStatistics.FIELDS, LinkStatistics.TYPES, LinkEventsReader.DIMENSIONS)
+        cursor.execute(make_create_query('_linkstats', LinkStatistics.FIELDS, types))
+
+def rename_tables(cursor, suffix, raw = True, statistics = False):
+    if raw:
+        cursor.execute('alter table _linktimes rename to link_times_%s' % suffix)
+
+    if statistics:
+        cursor.execute('create index link_stats_link_%s on _linkstats (link, bin)' % suffix)
+        cursor.execute('alter table _linkstats rename to link_stats_%s' % suffix)
+
+def table_names(suffix, raw = True, statistics = False):
+    return (['link_times_%s' % suffix] if raw else []) + (['link_stats_%s' % suffix] if statistics else [])
 
 if __name__ == '__main__':
+    batch_size = options.pop_option(sys.argv, '--batch-size', DEFAULT_BATCH_SIZE, int)
+    parser = options.pop_option(sys.argv, '--parser', engine.DEFAULT_BACKEND)
+    profile = options.pop_option(sys.argv, '--profile', database.DEFAULT_PROFILE)
+    pipelined = options.pop_flag(sys.argv, '--pipeline')
+    interned = options.pop_flag(sys.argv, '--intern')
+    interval = options.pop_option(sys.argv, '--checkpoint', 0, int)
+    resume = options.pop_flag(sys.argv, '--resume')
+    from_time = options.pop_option(sys.argv, '--from-time', None, convert.parse_seconds)
+    to_time = options.pop_option(sys.argv, '--to-time', None, convert.parse_seconds)
+    windowed = from_time is not None or to_time is not None
+    with_statistics = options.pop_flag(sys.argv, '--stats')
+    bin_size = options.pop_option(sys.argv, '--bin-size', DEFAULT_BIN_SIZE, float)
+    raw = not options.pop_flag(sys.argv, '--no-raw')
+
     if len(sys.argv) < 4:
-        print('read_events.py source_xml database suffix')
+        print('read_link_times.py source_xml database suffix [--batch-size N] [--parser %s] [--profile %s] [--pipeline] [--intern] [--checkpoint N] [--resume] [--from-time T] [--to-time T] [--stats] [--bin-size seconds] [--no-raw]' % ('|'.join(engine.BACKENDS), '|'.join(database.PROFILES)))
+
+    if not raw and not with_statistics:
+        print('Without raw link times, --stats is needed to write anything')
+        exit()
+
+    if windowed and (pipelined or resume or interval > 0):
+        print('Time windows are only read by the sequential mode without checkpoints')
+        exit()
+
+    if resume and interval == 0:
+        interval = checkpoint.DEFAULT_INTERVAL
+
+    if interval > 0 and (pipelined or parser != 'expat'):
+        print('Checkpoints are only written by the sequential mode with the expat parser')
+        exit()
+
+    if interval > 0 and profile == 'bulk':
+        print('Checkpoints need a journal, using the wal profile\n')
+        profile = 'wal'
+
+    if interned and pipelined:
+        print('Interned ids are only written by the sequential mode')
+        exit()
 
     source = pathlib.Path(sys.argv[1]).resolve()
     destination = sys.argv[2]
@@ -68,24 +167,50 @@ if __name__ == '__main__':
     print('    %s' % destination)
     print('')
 
-    connection = sqlite3.connect(str(destination))
+    connection = database.connect(str(destination), profile, not pipelined)
     cursor = connection.cursor()
 
-    cursor.execute("""
-        create table _linktimes (
-            link text,
-            enter_time real,
-            leave_time real)""")
+    interning = intern.Interning(cursor, batch_size) if interned else None
+
+    checkpoints = checkpoint.Checkpoints(cursor, 'link_times_%s' % suffix, source) if interval > 0 else None
+    resumed = checkpoints.load() if resume else None
+
+    if resumed is None:
+        create_tables(cursor, interning, raw, with_statistics)
+
+    statistics = LinkStatistics(bin_size) if with_statistics else None
 
     print('Reading link times ...\n')
 
-    reader = LinkEventsReader(cursor)
-    with gzip.open(str(source)) as f:
-        xml.sax.parse(f, reader)
+    if pipelined:
+        reader = pipeline.run(str(source), connection, lambda writer: LinkEventsReader(writer, batch_size, statistics = statistics, raw = raw), parser)
+    else:
+        reader = LinkEventsReader(cursor, batch_size, interning, statistics, raw)
+
+        if checkpoints is not None:
+            checkpoint.parse(str(source), reader, connection, checkpoints, interval, resumed, interning)
+        elif windowed:
+            with index_events.open_window(str(source), from_time, to_time) as f:
+                engine.parse(f, index_events.TimeWindowHandler(reader, from_time, to_time), parser)
+        else:
+            with gzip.open(str(source)) as f:
+                engine.parse(f, reader, parser)
+
+        if interning is not None:
+            interning.flush()
+
+    rename_tables(cursor, suffix, raw, with_statistics)
+
+    if checkpoints is not None:
+        checkpoints.clear()
 
-    cursor.execute('alter table _linktimes rename to link_times_%s' % suffix)
     connection.commit()
 
     print('Inconsistencies: ', reader.inconsistent)
     print('\nFinished reading %d link times!\n' % reader.count)
+
+    if with_statistics:
+        print('Aggregated them into %d link and time bins\n' % len(reader.statistics.bins))
+
+    database.analyze(connection, table_names(suffix, raw, with_statistics), profile)
     connection.close()
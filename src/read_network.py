@@ -2,35 +2,119 @@ import gzip
 import xml.sax
 import numpy as np
 import pathlib
-import sys, sqlite3
-import time
+import sys
+import time, math, array
+
+import options
+import engine
+import database, spatial, csr
+from writer import BufferedWriter, DEFAULT_BATCH_SIZE
 
 class NetworkReader(xml.sax.ContentHandler):
-    def __init__(self, cursor):
+    def __init__(self, cursor, batch_size = DEFAULT_BATCH_SIZE, adjacency = False):
         self.cursor = cursor
 
+        self.nodes = BufferedWriter(cursor, 'insert into _nodes (id, x, y) values (?,?,?)', batch_size)
+        self.links = BufferedWriter(cursor, 'insert into _links (id, from_id, to_id, length, x, y) values (?,?,?,?,?,?)', batch_size)
+        self.rtree = BufferedWriter(cursor, spatial.make_insert_query(), batch_size)
+
+        # Node indices and coordinates for the link geometry, the nodes come before the links in a network file
+        self.node_indices = {}
+        self.xs = array.array('d')
+        self.ys = array.array('d')
+
+        # Source node, target node (-1 if unknown) and length of each link for the CSR adjacency
+        self.adjacency = adjacency
+        self.sources = array.array('q')
+        self.targets = array.array('q')
+        self.lengths = array.array('d')
+
         self.display = time.time()
         self.nodecount = 0
         self.linkcount = 0
 
     def startElement(self, name, attributes):
         if name == 'node':
-            id, x, y = attributes['id'], attributes['x'], attributes['y']
-            self.cursor.execute('insert into _nodes (id, x, y) values (?,?,?)', (id, x, y))
+            id, x, y = attributes['id'], float(attributes['x']), float(attributes['y'])
+            self.nodes.append((id, x, y))
+
+            self.node_indices[id] = self.nodecount
+            self.xs.append(x)
+            self.ys.append(y)
             self.nodecount += 1
 
         elif name == 'link':
             id, from_, to = attributes['id'], attributes['from'], attributes['to']
-            self.cursor.execute('insert into _links (id, from_id, to_id) values (?,?,?)', (id, from_, to))
             self.linkcount += 1
 
+            from_index, to_index = self.node_indices.get(from_, -1), self.node_indices.get(to, -1)
+            known = from_index >= 0 and to_index >= 0
+
+            # The length attribute is the network length, curved links are longer than the line between their nodes
+            length = float(attributes['length']) if 'length' in attributes else None
+
+            if known:
+                from_x, from_y, to_x, to_y = self.xs[from_index], self.ys[from_index], self.xs[to_index], self.ys[to_index]
+
+                # Without the attribute, the straight line between the nodes stands in for the length
+                if length is None:
+                    length = math.hypot(to_x - from_x, to_y - from_y)
+
+                self.links.append((id, from_, to, length, 0.5 * (from_x + to_x), 0.5 * (from_y + to_y)))
+
+                # Links are inserted in order into a new table, so the link count is their rowid
+                self.rtree.append((self.linkcount, min(from_x, to_x), max(from_x, to_x), min(from_y, to_y), max(from_y, to_y), from_x, from_y, to_x, to_y))
+            else:
+                self.links.append((id, from_, to, length, None, None))
+
+            if self.adjacency:
+                self.sources.append(from_index if known else -1)
+                self.targets.append(to_index)
+                self.lengths.append(length if length is not None else math.nan)
+
         if self.display + 1.0 < time.time():
             print('   Read %d nodes and %d links  ...' % (self.nodecount, self.linkcount))
             self.display = time.time()
 
+    def endDocument(self):
+        self.nodes.flush()
+        self.links.flush()
+        self.rtree.flush()
+
+    def graph(self):
+        return csr.build(self.nodecount, self.sources, self.targets, self.lengths)
+
+def create_tables(cursor):
+    cursor.execute("""
+        create table _nodes (
+            id text,
+            x real,
+            y real)""")
+
+    cursor.execute("""
+        create table _links (
+            id text,
+            from_id text,
+            to_id text,
+            length real,
+            x real,
+            y real)""")
+
+    spatial.create_index(cursor)
+
+def rename_tables(cursor):
+    cursor.execute('alter table _nodes rename to nodes')
+    cursor.execute('alter table _links rename to links')
+    cursor.execute('alter table _links_rtree rename to links_rtree')
+
 if __name__ == '__main__':
+    batch_size = options.pop_option(sys.argv, '--batch-size', DEFAULT_BATCH_SIZE, int)
+    parser = options.pop_option(sys.argv, '--parser', engine.DEFAULT_BACKEND)
+    profile = options.pop_option(sys.argv, '--profile', database.DEFAULT_PROFILE)
+    csr_directory = options.pop_option(sys.argv, '--csr')
+
     if len(sys.argv) < 3:
-        print('read_network.py source_xml database')
+        print('read_network.py source_xml database [--batch-size N] [--parser %s] [--profile %s] [--csr directory]' % ('|'.join(engine.BACKENDS), '|'.join(database.PROFILES)))
         exit()
 
     source = pathlib.Path(sys.argv[1]).resolve()
@@ -44,33 +128,26 @@ if __name__ == '__main__':
     print('    %s' % destination)
     print('')
 
-    connection = sqlite3.connect(str(destination))
+    connection = database.connect(str(destination), profile)
     cursor = connection.cursor()
 
-    cursor.execute("""
-        create table _nodes (
-            id text,
-            x real,
-            y real)""")
-
-    cursor.execute("""
-        create table _links (
-            id text,
-            from_id text,
-            to_id text)""")
+    create_tables(cursor)
 
     print('Reading network ...\n')
 
-    reader = NetworkReader(cursor)
+    reader = NetworkReader(cursor, batch_size, csr_directory is not None)
     with gzip.open(str(source)) as f:
-        xml.sax.parse(f, reader)
+        engine.parse(f, reader, parser)
 
     connection.commit()
 
-    cursor.execute('alter table _nodes rename to nodes')
-    cursor.execute('alter table _links rename to links')
-
+    rename_tables(cursor)
     connection.commit()
 
     print('\nFinished reading network (%d nodes, %d links)!\n' % (reader.nodecount, reader.linkcount))
+
+    if csr_directory is not None:
+        csr.save(csr_directory, reader.graph())
+        print('Wrote the CSR adjacency to %s\n' % csr_directory)
+    database.analyze(connection, ['nodes', 'links'], profile)
     connection.close()
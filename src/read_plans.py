@@ -0,0 +1,208 @@
+import xml.sax
+import pathlib
+import sys
+import time
+
+import options
+import engine, plans_filter
+import database, intern, convert, routes
+from writer import BufferedWriter, DEFAULT_BATCH_SIZE, make_insert_query, make_create_query
+
+def parse_time(attributes, name):
+    value = attributes.get(name)
+    return None if value is None or value == 'undefined' else convert.parse_time(value)
+
+class PlansReader(xml.sax.ContentHandler):
+    """
+        Reads the selected plan of every person in one pass: the population (id and mode of the first leg),
+        the legs with their times and route distance, the activities with their coordinates and the link
+        sequences of network routes. With the expat backend, unselected plans are skipped by expat itself.
+        Route links are stored as integer ids: dim_links ids with --intern, otherwise links.rowid of the network,
+        which then has to be read into the database first so the ids can be looked up.
+    """
+
+    POPULATION_FIELDS = ('id', 'first_leg')
+    POPULATION_TYPES = ('text', 'text')
+
+    LEG_FIELDS = ('person', 'leg_index', 'mode', 'departure_time', 'travel_time', 'arrival_time', 'distance', 'route_type', 'start_link', 'end_link')
+    LEG_TYPES = ('text', 'integer', 'text', 'real', 'real', 'real', 'real', 'text', 'text', 'text')
+
+    ACTIVITY_FIELDS = ('person', 'activity_index', 'type', 'link', 'facility', 'x', 'y', 'start_time', 'end_time', 'max_duration')
+    ACTIVITY_TYPES = ('text', 'integer', 'text', 'text', 'text', 'real', 'real', 'real', 'real', 'real')
+
+    # Links of network routes are stored as routes.encode blobs of their integer ids
+    ROUTE_FIELDS = ('person', 'leg_index', 'link_count', 'links')
+    ROUTE_TYPES = ('text', 'integer', 'integer', 'blob')
+
+    TABLES = (
+        ('population', POPULATION_FIELDS, POPULATION_TYPES), ('plan_legs', LEG_FIELDS, LEG_TYPES),
+        ('plan_activities', ACTIVITY_FIELDS, ACTIVITY_TYPES), ('plan_routes', ROUTE_FIELDS, ROUTE_TYPES))
+
+    DIMENSIONS = {
+        'id' : 'persons', 'person' : 'persons', 'first_leg' : 'modes', 'mode' : 'modes',
+        'link' : 'links', 'start_link' : 'links', 'end_link' : 'links' }
+
+    def __init__(self, cursor, batch_size = DEFAULT_BATCH_SIZE, interning = None):
+        self.reset()
+        self.locator = None
+
+        self.display = time.time()
+        self.count = 0
+        self.legcount = 0
+        self.activitycount = 0
+        self.routecount = 0
+
+        self.cursor = cursor
+        self.writers = {}
+
+        for table, fields, types in PlansReader.TABLES:
+            converters = convert.converters(fields, types, interning, PlansReader.DIMENSIONS)
+            self.writers[table] = BufferedWriter(cursor, make_insert_query('_%s' % table, fields), batch_size, converters)
+
+        self.population = self.writers['population']
+        self.legs = self.writers['plan_legs']
+        self.activities = self.writers['plan_activities']
+        self.routes = self.writers['plan_routes']
+
+        # Without --intern the ids are only kept in memory, nothing is written to dim_links
+        self.link_ids = interning.get('links') if interning is not None else intern.LocalInterner(cursor, 'links')
+
+    def reset(self):
+        self.person = None
+        self.selected = False
+        self.first_leg = None
+        self.leg = None
+        self.route = None
+        self.leg_index = 0
+        self.activity_index = 0
+
+    def setDocumentLocator(self, locator):
+        self.locator = locator
+
+    def startElement(self, name, attributes):
+        if name == 'person':
+            self.person = attributes['id']
+        elif name == 'plan':
+            self.selected = attributes.get('selected') == 'yes'
+
+            # Only the expat locator can skip, other backends still report the children
+            if not self.selected and hasattr(self.locator, 'skip'):
+                self.locator.skip('plan')
+        elif not self.selected:
+            return
+        elif name == 'activity':
+            self.activities.append((
+                self.person, self.activity_index, attributes['type'], attributes.get('link'), attributes.get('facility'),
+                attributes.get('x'), attributes.get('y'),
+                parse_time(attributes, 'start_time'), parse_time(attributes, 'end_time'), parse_time(attributes, 'max_dur')))
+
+            self.activity_index += 1
+            self.activitycount += 1
+        elif name == 'leg':
+            if self.first_leg is None:
+                self.first_leg = attributes['mode']
+
+            self.leg = [
+                self.person, self.leg_index, attributes['mode'],
+                parse_time(attributes, 'dep_time'), parse_time(attributes, 'trav_time'), parse_time(attributes, 'arr_time'),
+                None, None, None, None]
+        elif name == 'route' and self.leg is not None:
+            self.leg[6:] = [attributes.get('distance'), attributes.get('type'), attributes.get('start_link'), attributes.get('end_link')]
+
+            if attributes.get('type') == 'links':
+                self.route = []
+
+    def characters(self, content):
+        if self.route is not None:
+            self.route.append(content)
+
+    def endElement(self, name):
+        if name == 'route' and self.route is not None:
+            links = [self.link_ids(link) for link in ''.join(self.route).split()]
+            self.routes.append((self.person, self.leg_index, len(links), routes.encode(links)))
+            self.routecount += 1
+            self.route = None
+        elif name == 'leg' and self.leg is not None:
+            self.legs.append(self.leg)
+            self.leg = None
+            self.leg_index += 1
+            self.legcount += 1
+        elif name == 'plan':
+            self.selected = False
+        elif name == 'person':
+            if self.first_leg is not None:
+                self.population.append((self.person, self.first_leg))
+
+            self.count += 1
+
+            if self.display + 1.0 < time.time():
+                print('   Read %d persons ...' % self.count)
+                self.display = time.time()
+
+            self.reset()
+
+    def endDocument(self):
+        for writer in self.writers.values():
+            writer.flush()
+
+        self.link_ids.flush()
+
+def create_tables(cursor, interning = None):
+    for table, fields, types in PlansReader.TABLES:
+        # Left over by an interrupted run
+        cursor.execute('drop table if exists _%s' % table)
+        cursor.execute(make_create_query('_%s' % table, fields, intern.types(interning, fields, types, PlansReader.DIMENSIONS)))
+
+def rename_tables(cursor, suffix):
+    for table, fields, types in PlansReader.TABLES:
+        cursor.execute('alter table _%s rename to %s_%s' % (table, table, suffix))
+
+if __name__ == '__main__':
+    batch_size = options.pop_option(sys.argv, '--batch-size', DEFAULT_BATCH_SIZE, int)
+    parser = options.pop_option(sys.argv, '--parser', engine.DEFAULT_BACKEND)
+    profile = options.pop_option(sys.argv, '--profile', database.DEFAULT_PROFILE)
+    interned = options.pop_flag(sys.argv, '--intern')
+    selected = not options.pop_flag(sys.argv, '--no-filter')
+
+    if len(sys.argv) < 4:
+        print('read_plans.py source_xml database suffix [--batch-size N] [--parser %s] [--profile %s] [--intern] [--no-filter]' % ('|'.join(engine.BACKENDS), '|'.join(database.PROFILES)))
+        exit()
+
+    source = pathlib.Path(sys.argv[1]).resolve()
+    destination = pathlib.Path(sys.argv[2])
+    suffix = sys.argv[3]
+
+    print('Converting plans from:')
+    print('    %s' % source)
+    print('')
+
+    print('Will write to tables %s in:' % ', '.join(['%s_%s' % (table, suffix) for table, fields, types in PlansReader.TABLES]))
+    print('    %s ' % destination)
+    print('')
+
+    connection = database.connect(str(destination), profile)
+    cursor = connection.cursor()
+
+    interning = intern.Interning(cursor, batch_size) if interned else None
+    create_tables(cursor, interning)
+
+    print('Reading plans ...\n')
+
+    reader = PlansReader(cursor, batch_size, interning)
+
+    with plans_filter.open_plans(str(source), selected) as f:
+        engine.parse(f, reader, parser)
+
+    if interning is not None:
+        interning.flush()
+
+    connection.commit()
+
+    print('\nFinished reading %d persons!\n' % reader.count)
+    print('Read %d legs, %d activities and %d network routes of the selected plans\n' % (reader.legcount, reader.activitycount, reader.routecount))
+
+    rename_tables(cursor, suffix)
+    connection.commit()
+
+    database.analyze(connection, ['%s_%s' % (table, suffix) for table, fields, types in PlansReader.TABLES], profile)
+    connection.close()
@@ -1,18 +1,28 @@
-import gzip
 import xml.sax
 import numpy as np
 import pathlib
-import sys, sqlite3
+import sys
 import time
 
+import options
+import engine, plans_filter
+import database, intern, convert
+from writer import BufferedWriter, DEFAULT_BATCH_SIZE, make_insert_query, make_create_query
+
 class PopulationReader(xml.sax.ContentHandler):
-    def __init__(self, cursor):
+    FIELDS = ('id', 'first_leg')
+    TYPES = ('text', 'text')
+
+    DIMENSIONS = { 'id' : 'persons', 'first_leg' : 'modes' }
+
+    def __init__(self, cursor, batch_size = DEFAULT_BATCH_SIZE, interning = None):
         self.reset()
 
         self.display = time.time()
         self.count = 0
 
         self.cursor = cursor
+        self.writer = BufferedWriter(cursor, make_insert_query('_population', PopulationReader.FIELDS), batch_size, convert.converters(PopulationReader.FIELDS, PopulationReader.TYPES, interning, PopulationReader.DIMENSIONS))
 
     def reset(self):
         self.person = None
@@ -28,9 +38,11 @@ class PopulationReader(xml.sax.ContentHandler):
             self.first_leg = attributes['mode']
 
     def endElement(self, name):
-        if name == 'person':
+        if name == 'plan':
+            self.selected = False
+        elif name == 'person':
             if self.first_leg is not None:
-                self.cursor.execute('insert into _population (id, first_leg) values (?,?)', (self.person, self.first_leg))
+                self.writer.append((self.person, self.first_leg))
 
             self.count += 1
 
@@ -40,9 +52,18 @@ class PopulationReader(xml.sax.ContentHandler):
 
             self.reset()
 
+    def endDocument(self):
+        self.writer.flush()
+
 if __name__ == '__main__':
+    batch_size = options.pop_option(sys.argv, '--batch-size', DEFAULT_BATCH_SIZE, int)
+    parser = options.pop_option(sys.argv, '--parser', engine.DEFAULT_BACKEND)
+    profile = options.pop_option(sys.argv, '--profile', database.DEFAULT_PROFILE)
+    interned = options.pop_flag(sys.argv, '--intern')
+    selected = not options.pop_flag(sys.argv, '--no-filter')
+
     if len(sys.argv) < 4:
-        print('read_population.py source_xml database suffix')
+        print('read_population.py source_xml database suffix [--batch-size N] [--parser %s] [--profile %s] [--intern] [--no-filter]' % ('|'.join(engine.BACKENDS), '|'.join(database.PROFILES)))
         exit()
 
     source = pathlib.Path(sys.argv[1]).resolve()
@@ -59,21 +80,23 @@ if __name__ == '__main__':
     print('    %s ' % destination)
     print('')
 
-    connection = sqlite3.connect(str(destination))
+    connection = database.connect(str(destination), profile)
     cursor = connection.cursor()
 
-    cursor.execute('create table _population (id text, first_leg text)')
+    interning = intern.Interning(cursor, batch_size) if interned else None
+
+    types = intern.types(interning, PopulationReader.FIELDS, PopulationReader.TYPES, PopulationReader.DIMENSIONS)
+    cursor.execute(make_create_query('_population', PopulationReader.FIELDS, types))
 
     print('Reading population ...\n')
 
-    reader = PopulationReader(cursor)
+    reader = PopulationReader(cursor, batch_size, interning)
+
+    with plans_filter.open_plans(str(source), selected) as f:
+        engine.parse(f, reader, parser)
 
-    if str(source)[-2:] == 'gz':
-        with gzip.open(str(source)) as f:
-            xml.sax.parse(f, reader)
-    else:
-        with open(str(source)) as f:
-            xml.sax.parse(f, reader)
+    if interning is not None:
+        interning.flush()
 
     connection.commit()
     print('\nFinished reading %d persons!\n' % reader.count)
@@ -81,4 +104,5 @@ if __name__ == '__main__':
     cursor.execute('alter table _population rename to %s' % table)
     connection.commit()
 
+    database.analyze(connection, ['population_%s' % suffix], profile)
     connection.close()
@@ -1,60 +1,141 @@
-import sys, pickle
+import sys, os, warnings
 import pathlib, time
+import concurrent.futures
 import numpy as np
 
-if len(sys.argv) < 3:
-    print('read_relaxation.py matsim_output_path result_path [modes]')
-    exit()
+import options
 
-source = pathlib.Path(sys.argv[1]).resolve()
-destination = sys.argv[2]
+FIELDS = ('iteration', 'size', 'mtime')
 
-modes = sys.argv[3].split(',') if len(sys.argv) > 3 else ['av', 'car', 'pt']
+def read_histogram(path, modes):
+    """ Sums the departures of each mode over all time bins of a legHistogram.txt. """
+    shares = [0] * len(modes)
 
-iterations = []
-shares = []
+    with open(path) as f:
+        header = f.readline().rstrip('\n').split('\t')
 
-display = time.time()
-count = 0
+        columns = [(index, header.index('departures_' + mode)) for index, mode in enumerate(modes) if 'departures_' + mode in header]
+        if len(columns) == 0: return shares
 
-print('Reading relaxation over iterations ...\n')
+        with warnings.catch_warnings():
+            # A histogram with only a header is read as empty
+            warnings.simplefilter('ignore')
+            values = np.loadtxt(f, delimiter = '\t', usecols = [column for index, column in columns], dtype = np.int64, ndmin = 2)
 
-for path in pathlib.Path('%s/ITERS' % source).resolve().iterdir():
-    i = int(str(path).split('.')[1])
-    iterations.append(i)
+    for (index, column), total in zip(columns, values.sum(axis = 0)):
+        shares[index] = int(total)
 
-    histogram_path = '%s/%d.legHistogram.txt' % (path, i)
+    return shares
 
-    itshares = [0] * len(modes)
-    indices = []
+def load_results(path, modes):
+    """
+        Returns iteration -> (size, mtime, shares) from an existing result file, {} if there is none,
+        or None if it was written for other modes or is no result table (e.g. the pickle of earlier versions).
+    """
+    if not os.path.exists(path): return {}
 
-    with open(str(histogram_path)) as f:
-        for row in f:
-            row = row.split('\t')
+    results = {}
 
-            if row[0] == 'time':
-                indices = [row.index('departures_' + mode) if 'departures_' + mode in row else None for mode in modes]
-            else:
-                for mi in range(len(modes)):
-                    if indices[mi] is not None:
-                        itshares[mi] += int(row[indices[mi]])
+    # Read as bytes, a pickle is not valid text
+    with open(path, 'rb') as f:
+        try:
+            if f.readline().decode().rstrip('\n').split('\t') != list(FIELDS) + list(modes):
+                return None
 
-    shares.append(itshares)
-    count += 1
+            for row in f:
+                row = row.decode().rstrip('\n').split('\t')
+                results[int(row[0])] = (int(row[1]), float(row[2]), [int(value) for value in row[3:]])
+        except ValueError:
+            return None
 
-    if display + 1.0 < time.time():
-        print('   Read %d iterations ...' % count)
-        display = time.time()
+    return results
 
-shares = np.array(shares)
-iterations = np.array(iterations)
+def write_results(f, results):
+    for iteration in sorted(results):
+        size, mtime, shares = results[iteration]
+        f.write('\t'.join([str(iteration), str(size), repr(mtime)] + [str(share) for share in shares]) + '\n')
 
-data = np.column_stack((iterations, shares))
-indices = np.argsort(data[:,0])
+def load_relaxation(path):
+    """ Returns (data, modes) like the former pickle: one row [iteration, shares...] per iteration, ordered by iteration. """
+    with open(path) as f:
+        modes = f.readline().rstrip('\n').split('\t')[len(FIELDS):]
 
-data = data[indices,:]
+    usecols = [0] + list(range(len(FIELDS), len(FIELDS) + len(modes)))
+    data = np.loadtxt(path, delimiter = '\t', skiprows = 1, usecols = usecols, dtype = np.int64, ndmin = 2)
 
-with open(str(destination), 'wb+') as f:
-    pickle.dump((data, modes), f)
+    return data[np.argsort(data[:,0])], modes
 
-print('Done reading iterations.')
+if __name__ == '__main__':
+    processes = options.pop_option(sys.argv, '--processes', os.cpu_count() or 1, int)
+
+    if len(sys.argv) < 3:
+        print('read_relaxation.py matsim_output_path result_path [modes] [--processes N]')
+        exit()
+
+    source = pathlib.Path(sys.argv[1]).resolve()
+    destination = sys.argv[2]
+
+    modes = sys.argv[3].split(',') if len(sys.argv) > 3 else ['av', 'car', 'pt']
+
+    cached = load_results(destination, modes)
+    rewrite = cached is None
+    cached = cached or {}
+
+    tasks = {}
+
+    for path in (source / 'ITERS').iterdir():
+        if not path.name.startswith('it.'): continue
+
+        iteration = int(path.name.split('.')[1])
+        histogram_path = path / ('%d.legHistogram.txt' % iteration)
+
+        # The iteration of a running simulation is not finished yet
+        if not histogram_path.exists(): continue
+
+        stat = histogram_path.stat()
+
+        if iteration in cached and cached[iteration][:2] == (stat.st_size, stat.st_mtime):
+            continue
+
+        tasks[iteration] = (str(histogram_path), stat.st_size, stat.st_mtime)
+
+    print('Reading relaxation over iterations (%d cached, %d to read) ...\n' % (len(cached), len(tasks)))
+
+    results = {}
+
+    display = time.time()
+    count = 0
+
+    with concurrent.futures.ProcessPoolExecutor(processes) as executor:
+        futures = {
+            executor.submit(read_histogram, histogram_path, modes) : (iteration, size, mtime)
+            for iteration, (histogram_path, size, mtime) in tasks.items() }
+
+        for future in concurrent.futures.as_completed(futures):
+            iteration, size, mtime = futures[future]
+            results[iteration] = (size, mtime, future.result())
+            count += 1
+
+            if display + 1.0 < time.time():
+                print('   Read %d iterations ...' % count)
+                display = time.time()
+
+    # New iterations are appended, the file is only rewritten if a cached iteration changed
+    rewrite = rewrite or any([iteration in cached for iteration in results])
+
+    if rewrite:
+        cached.update(results)
+
+        with open(destination, 'w') as f:
+            f.write('\t'.join(list(FIELDS) + modes) + '\n')
+            write_results(f, cached)
+    elif len(results) > 0:
+        exists = os.path.exists(destination)
+
+        with open(destination, 'a') as f:
+            if not exists:
+                f.write('\t'.join(list(FIELDS) + modes) + '\n')
+
+            write_results(f, results)
+
+    print('Done reading iterations.')
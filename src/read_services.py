@@ -2,9 +2,15 @@ import gzip
 import xml.sax
 import numpy as np
 import pathlib
-import sys, sqlite3
+import sys
 import time
 
+import options
+import engine, output
+import database, intern, convert
+from writer import BufferedWriter, DEFAULT_BATCH_SIZE, make_insert_query, make_create_query
+from aggregate import ServiceStatistics, DEFAULT_BIN_SIZE
+
 class ServiceReader(xml.sax.ContentHandler):
 	REQUEST_ATTRIBUTES = (None, 'dropoffLinkId', 'passengerId', 'pickupLinkId', 'pickupTime', 'submissionTime')
 	REQUEST_FIELDS = ('request_id', 'dropoff_link', 'passenger', 'pickup_link', 'pickup_time', 'submission_time')
@@ -20,14 +26,39 @@ class ServiceReader(xml.sax.ContentHandler):
 		'integer primary key', 'integer', 'real', 'real', 'real', 'real', 'real', 'real', 'real', 'real', 'real',
 		'real', 'real', 'text', 'text', 'text')
 
-	def __init__(self, cursor):
+	TABLES = (('services', SERVICE_FIELDS, SERVICE_TYPES), ('requests', REQUEST_FIELDS, REQUEST_TYPES))
+
+	# Derived while reading: pickup - submission time, dropoff - pickup time and the share of the distance driven empty
+	KPI_FIELDS = ('wait_time', 'in_vehicle_time', 'empty_distance_ratio')
+	KPI_TYPES = ('real', 'real', 'real')
+
+	KPI_TABLES = (('services', SERVICE_FIELDS + KPI_FIELDS, SERVICE_TYPES + KPI_TYPES), ('requests', REQUEST_FIELDS, REQUEST_TYPES))
+
+	DIMENSIONS = {
+		'dropoff_link' : 'links', 'pickup_link' : 'links', 'start_link' : 'links',
+		'passenger' : 'persons', 'driver' : 'persons' }
+
+	def __init__(self, cursor, batch_size = DEFAULT_BATCH_SIZE, interning = None, kpis = False, statistics = None):
 		self.cursor = cursor
+		self.kpis = kpis or statistics is not None
+		self.statistics = statistics
 		self.service = None
 		self.request = None
 
 		self.display = time.time()
 		self.count = 0
 
+		types = dict(zip(ServiceReader.REQUEST_FIELDS, ServiceReader.REQUEST_TYPES))
+		fields = ['request_id'] + [field for field, attr in zip(ServiceReader.REQUEST_FIELDS, ServiceReader.REQUEST_ATTRIBUTES) if attr is not None]
+		converters = convert.converters(fields, [types[field] for field in fields], interning, ServiceReader.DIMENSIONS)
+		self.requests = BufferedWriter(cursor, make_insert_query('_requests', fields), batch_size, converters)
+
+		types = dict(zip(ServiceReader.SERVICE_FIELDS + ServiceReader.KPI_FIELDS, ServiceReader.SERVICE_TYPES + ServiceReader.KPI_TYPES))
+		fields = [field for field, attr in zip(ServiceReader.SERVICE_FIELDS, ServiceReader.SERVICE_ATTRIBUTES) if attr is not None] + ['request_id']
+		if self.kpis: fields += list(ServiceReader.KPI_FIELDS)
+		converters = convert.converters(fields, [types[field] for field in fields], interning, ServiceReader.DIMENSIONS)
+		self.services = BufferedWriter(cursor, make_insert_query('_services', fields), batch_size, converters)
+
 	def startElement(self, name, attributes):
 		if name == 'service':
 			self.service = attributes
@@ -37,36 +68,92 @@ class ServiceReader(xml.sax.ContentHandler):
 
 	def endElement(self, name):
 		if name == 'service':
-			fields = [field for field, attr in zip(ServiceReader.REQUEST_FIELDS, ServiceReader.REQUEST_ATTRIBUTES) if attr is not None]
-			values = ['?'] * len(fields)
-
-			fields, values = ','.join(fields), ','.join(values)
-			data = [self.request[attr] for attr in ServiceReader.REQUEST_ATTRIBUTES if attr is not None]
-
-			query = 'insert into _requests (%s) values (%s)' % (fields, values)
-			self.cursor.execute(query, data)
+			# Request ids are assigned here instead of relying on lastrowid, because rows are only inserted in batches
+			request_id = self.count + 1
 
-			fields = [field for field, attr in zip(ServiceReader.SERVICE_FIELDS, ServiceReader.SERVICE_ATTRIBUTES) if attr is not None]
-			values = ['?'] * (len(fields) + 1)
-			fields.append('request_id')
+			data = [request_id] + [self.request[attr] for attr in ServiceReader.REQUEST_ATTRIBUTES if attr is not None]
+			self.requests.append(data)
 
-			fields, values = ','.join(fields), ','.join(values)
 			data = [self.service[attr] for attr in ServiceReader.SERVICE_ATTRIBUTES if attr is not None]
-			data.append(self.cursor.lastrowid)
+			data.append(request_id)
 
-			query = 'insert into _services (%s) values (%s)' % (fields, values)
-			self.cursor.execute(query, data)
+			if self.kpis:
+				data += self.derive()
+
+			self.services.append(data)
 			self.count += 1
 
 			if self.display + 1.0 < time.time():
 				print('   Read %d services ...' % self.count)
 				self.display = time.time()
 
+	def derive(self):
+		service = self.service
+
+		pickup_time, dropoff_time = float(service['pickupTime']), float(service['dropoffTime'])
+		pickup_distance, dropoff_distance = float(service['pickupDriveDistance']), float(service['dropoffDriveDistance'])
+
+		wait_time = pickup_time - float(self.request['submissionTime'])
+		distance = pickup_distance + dropoff_distance
+
+		if self.statistics is not None:
+			self.statistics.add(
+				service['driverAgent'], float(service['startTime']), float(service['endTime']),
+				pickup_time, dropoff_time, wait_time, pickup_distance, dropoff_distance)
+
+		return [wait_time, dropoff_time - pickup_time, pickup_distance / distance if distance > 0.0 else None]
+
+	def endDocument(self):
+		self.requests.flush()
+		self.services.flush()
+
+def write_statistics(cursor, statistics, suffix, interning = None, batch_size = DEFAULT_BATCH_SIZE):
+	""" Writes the per driver and per time bin aggregates into service_drivers_<suffix> and service_bins_<suffix>. """
+	tables = (
+		('service_drivers', ServiceStatistics.DRIVER_FIELDS, ServiceStatistics.DRIVER_TYPES, statistics.driver_rows()),
+		('service_bins', ServiceStatistics.BIN_FIELDS, ServiceStatistics.BIN_TYPES, statistics.bin_rows()))
+
+	for table, fields, types, rows in tables:
+		table = '%s_%s' % (table, suffix)
+
+		if isinstance(cursor, output.ParquetOutput):
+			cursor.create_table(table, fields, types)
+		else:
+			cursor.execute('drop table if exists %s' % table)
+			cursor.execute(make_create_query(table, fields, intern.types(interning, fields, types, ServiceReader.DIMENSIONS)))
+
+		writer = BufferedWriter(cursor, make_insert_query(table, fields), batch_size, convert.converters(fields, types, interning, ServiceReader.DIMENSIONS))
+
+		for row in rows:
+			writer.append(row)
+
+		writer.flush()
+
+	if interning is not None:
+		interning.flush()
+
+	return ['%s_%s' % (table, suffix) for table, fields, types, rows in tables]
+
 if __name__ == '__main__':
+    batch_size = options.pop_option(sys.argv, '--batch-size', DEFAULT_BATCH_SIZE, int)
+    parser = options.pop_option(sys.argv, '--parser', engine.DEFAULT_BACKEND)
+    profile = options.pop_option(sys.argv, '--profile', database.DEFAULT_PROFILE)
+    output_format = options.pop_option(sys.argv, '--format', 'sqlite')
+    interned = options.pop_flag(sys.argv, '--intern')
+    kpis = options.pop_flag(sys.argv, '--kpis')
+    bin_size = options.pop_option(sys.argv, '--bin-size', DEFAULT_BIN_SIZE, float)
+    fleet_size = options.pop_option(sys.argv, '--fleet-size', None, int)
+
     if len(sys.argv) < 4:
-        print('read_services.py source_xml database suffix')
+        print('read_services.py source_xml database suffix [--batch-size N] [--parser %s] [--profile %s] [--format %s] [--intern] [--kpis] [--bin-size seconds] [--fleet-size N]' % ('|'.join(engine.BACKENDS), '|'.join(database.PROFILES), '|'.join(output.FORMATS)))
         exit()
 
+    if interned and output_format == 'parquet':
+        print('Interned ids are only written to SQLite')
+        exit()
+
+    tables = ServiceReader.KPI_TABLES if kpis else ServiceReader.TABLES
+
     source = pathlib.Path(sys.argv[1]).resolve()
     destination = sys.argv[2]
     suffix = sys.argv[3]
@@ -79,30 +166,51 @@ if __name__ == '__main__':
     print('    %s' % destination)
     print('')
 
-    connection = sqlite3.connect(str(destination))
-    cursor = connection.cursor()
+    if output_format == 'parquet':
+        cursor = output.ParquetOutput(destination)
+
+        for table, fields, types in tables:
+            cursor.create_table('_%s' % table, fields, types)
+    else:
+        connection = database.connect(str(destination), profile)
+        cursor = connection.cursor()
 
-    fields = ','.join(['%s %s' % (field, ftype) for field, ftype in zip(ServiceReader.SERVICE_FIELDS, ServiceReader.SERVICE_TYPES)])
-    cursor.execute('create table _services (%s)' % fields)
+    interning = intern.Interning(cursor, batch_size) if interned else None
 
-    fields = ','.join(['%s %s' % (field, ftype) for field, ftype in zip(ServiceReader.REQUEST_FIELDS, ServiceReader.REQUEST_TYPES)])
-    cursor.execute('create table _requests (%s)' % fields)
+    if output_format == 'sqlite':
+        for table, fields, types in tables:
+            cursor.execute(make_create_query('_%s' % table, fields, intern.types(interning, fields, types, ServiceReader.DIMENSIONS)))
 
     print('Reading services ...\n')
 
-    reader = ServiceReader(cursor)
+    # Without the fleet size, utilization is left empty
+    statistics = ServiceStatistics(bin_size, fleet_size) if kpis else None
+    reader = ServiceReader(cursor, batch_size, interning, kpis, statistics)
     with gzip.open(str(source)) as f:
-        xml.sax.parse(f, reader)
+        engine.parse(f, reader, parser)
+
+    if interning is not None:
+        interning.flush()
 
-    connection.commit()
     print('\nFinished reading %d services!\n' % reader.count)
-    connection.commit()
 
-    requests_table = 'requests_%s' % suffix
-    services_table = 'services_%s' % suffix
+    summaries = []
+
+    if statistics is not None:
+        summaries = write_statistics(cursor, statistics, suffix, interning, batch_size)
+        print('Aggregated them for %d drivers into %s\n' % (len(statistics.drivers), ', '.join(summaries)))
+
+    if output_format == 'parquet':
+        for table, fields, types in tables:
+            cursor.rename('_%s' % table, '%s_%s' % (table, suffix))
+
+        cursor.close()
+    else:
+        connection.commit()
 
-    cursor.execute('alter table _requests rename to %s' % requests_table)
-    cursor.execute('alter table _services rename to %s' % services_table)
+        for table, fields, types in tables:
+            cursor.execute('alter table _%s rename to %s_%s' % (table, table, suffix))
 
-    connection.commit()
-    connection.close()
+        connection.commit()
+        database.analyze(connection, ['%s_%s' % (table, suffix) for table, fields, types in tables] + summaries, profile)
+        connection.close()
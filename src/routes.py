@@ -0,0 +1,76 @@
+import numpy as np
+
+def encode(links):
+    """
+        Encodes a sequence of integer link ids as a blob: the difference to the previous link (the first one
+        to 0), zigzag encoded so small negative steps stay small, as LEB128 varints. Links of a route are
+        usually numbered close to each other, so most of them take one or two bytes.
+    """
+    data = bytearray()
+    previous = 0
+
+    for link in links:
+        delta = link - previous
+        previous = link
+
+        value = (delta << 1) ^ (delta >> 63)
+
+        while value >= 0x80:
+            data.append((value & 0x7f) | 0x80)
+            value >>= 7
+
+        data.append(value)
+
+    return bytes(data)
+
+def decode_varints(data):
+    """ Decodes a uint8 array of concatenated varints into their zigzag decoded values, without a loop in Python. """
+    if len(data) == 0:
+        return np.zeros(0, dtype = np.int64)
+
+    ends = np.flatnonzero(data < 0x80)
+    starts = np.empty_like(ends)
+    starts[0] = 0
+    starts[1:] = ends[:-1] + 1
+
+    # Position of each byte in its varint
+    positions = np.arange(len(data)) - np.repeat(starts, ends - starts + 1)
+
+    values = np.bitwise_or.reduceat((data & 0x7f).astype(np.int64) << (7 * positions), starts)
+    return (values >> 1) ^ -(values & 1)
+
+def decode(blob):
+    """ Returns the link ids of an encoded route as an int64 array. """
+    return np.cumsum(decode_varints(np.frombuffer(blob, dtype = np.uint8)))
+
+def decode_many(blobs):
+    """
+        Decodes many routes at once into (offsets, links): the links of route i are links[offsets[i]:offsets[i + 1]],
+        like the adjacency of csr.Graph.
+    """
+    data = np.frombuffer(b''.join(blobs), dtype = np.uint8)
+    deltas = decode_varints(data)
+
+    sizes = np.array([len(blob) for blob in blobs], dtype = np.int64)
+    byte_offsets = np.zeros(len(blobs) + 1, dtype = np.int64)
+    np.cumsum(sizes, out = byte_offsets[1:])
+
+    # Every varint ends with a byte below 0x80, so these count the links before each route
+    ends = np.zeros(len(data) + 1, dtype = np.int64)
+    np.cumsum(data < 0x80, out = ends[1:])
+    offsets = ends[byte_offsets]
+
+    # Deltas start over with every route, so the running sum is reset at route starts
+    links = np.cumsum(deltas)
+    before = np.concatenate([[0], links])[offsets[:-1]]
+    links -= np.repeat(before, np.diff(offsets))
+
+    return offsets, links
+
+def read_routes(cursor, table):
+    """ Reads a plan_routes table into (persons, leg indices, offsets, links), see decode_many. """
+    cursor.execute('select person, leg_index, links from %s order by rowid' % table)
+    rows = cursor.fetchall()
+
+    offsets, links = decode_many([row[2] for row in rows])
+    return [row[0] for row in rows], np.array([row[1] for row in rows], dtype = np.int64), offsets, links
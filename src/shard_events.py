@@ -0,0 +1,380 @@
+import os, shutil
+import pathlib
+import sys
+import time
+import concurrent.futures
+
+import options
+import engine
+import database
+from writer import DEFAULT_BATCH_SIZE
+from chunks import bgzf_blocks, read_chunks, range_chunks, ChunkStream
+
+import ingest_events, read_events, read_entered_link, read_link_times
+
+class ShardEventsReader(read_events.EventsReader):
+    """
+        EventsReader for one shard. The first activity and leg event of each person may depend on state
+        from earlier shards, so those are kept as heads for the merge instead of being resolved here.
+    """
+
+    def __init__(self, cursor, batch_size = DEFAULT_BATCH_SIZE):
+        read_events.EventsReader.__init__(self, cursor, batch_size)
+
+        # Departure and arrival heads keep the number of legs written before them, so the merge can put their legs in place
+        self.heads = []
+        self.touched_activities = set()
+        self.touched_legs = set()
+
+    def departure(self, attributes):
+        person = attributes['person']
+
+        if not person in self.touched_legs:
+            self.touched_legs.add(person)
+            self.heads.append(('departure', person, attributes['time'], attributes['legMode'], attributes['link'], self.legcount))
+
+        read_events.EventsReader.departure(self, attributes)
+
+    def arrival(self, attributes):
+        person = attributes['person']
+
+        if not person in self.touched_legs:
+            self.heads.append(('arrival', person, attributes['time'], attributes['legMode'], attributes['link'], self.legcount))
+            return
+
+        read_events.EventsReader.arrival(self, attributes)
+
+    def activity_start(self, event_id, etime, attributes):
+        person = attributes['person']
+
+        if not person in self.touched_activities:
+            self.touched_activities.add(person)
+            self.heads.append(('actstart', person, event_id, etime, attributes['link'], attributes['actType']))
+
+        read_events.EventsReader.activity_start(self, event_id, etime, attributes)
+
+    def activity_end(self, event_id, etime, attributes):
+        person = attributes['person']
+
+        if not person in self.touched_activities:
+            self.touched_activities.add(person)
+            self.heads.append(('actend', person, event_id, etime, attributes['link'], attributes['actType']))
+            return
+
+        if not person in self.currentActivity:
+            # The simulation start time is only known after merging, so it is filled in there
+            self.activities.append((person, None, event_id, None, etime, attributes['link'], attributes['actType']))
+            self.activitycount += 1
+            self.fixstart += 1
+            return
+
+        read_events.EventsReader.activity_end(self, event_id, etime, attributes)
+
+    def endDocument(self):
+        # Open activities and departures are carried over to the next shard by the merge
+        self.writer.flush()
+        self.legs.flush()
+        self.activities.flush()
+
+class ShardLinkEventsReader(read_link_times.LinkEventsReader):
+    """
+        LinkEventsReader for one shard. Events of a vehicle up to its first 'left link' are kept as heads for the merge,
+        with the number of link times written before them.
+    """
+
+    def __init__(self, cursor, batch_size = DEFAULT_BATCH_SIZE):
+        read_link_times.LinkEventsReader.__init__(self, cursor, batch_size)
+
+        self.heads = []
+        self.resolved = set()
+
+    def startElement(self, name, attributes):
+        if not 'type' in attributes: return
+        type = attributes['type']
+        if not type in read_link_times.LinkEventsReader.EVENT_TYPES: return
+
+        vehicle = attributes['vehicle']
+
+        if not vehicle in self.resolved:
+            self.heads.append((type, attributes['time'], vehicle, attributes['link'], self.count))
+            if type == 'left link': self.resolved.add(vehicle)
+            return
+
+        read_link_times.LinkEventsReader.startElement(self, name, attributes)
+
+def ingest_shard(source, start, end, blocks, shard_database, sinks, batch_size, parser):
+    # Shard databases are scratch files, so they are always bulk loaded
+    connection = database.connect(shard_database, 'bulk')
+    cursor = connection.cursor()
+
+    ingest_events.create_tables(cursor, sinks, 'shard')
+
+    dispatcher = ingest_events.EventsDispatcher()
+    dispatcher.display = float('inf')
+
+    if 'events' in sinks:
+        reader = ShardEventsReader(cursor, batch_size)
+        reader.display = float('inf')
+        dispatcher.register('events', reader, read_events.EventsReader.EVENT_TYPES)
+
+    if 'entered_link' in sinks:
+        reader = read_entered_link.EventsReader(cursor, batch_size, 'entered_link')
+        reader.display = float('inf')
+        dispatcher.register('entered_link', reader, read_entered_link.EventsReader.EVENT_TYPES)
+
+    if 'link_times' in sinks:
+        reader = ShardLinkEventsReader(cursor, batch_size)
+        reader.display = float('inf')
+        dispatcher.register('link_times', reader, read_link_times.LinkEventsReader.EVENT_TYPES)
+
+    engine.parse(ChunkStream(range_chunks(read_chunks(source, start, blocks), start, end)), dispatcher, parser)
+    connection.commit()
+    connection.close()
+
+    result = { 'database' : shard_database, 'count' : dispatcher.count }
+
+    if 'events' in sinks:
+        reader = dispatcher.readers['events']
+        result['events'] = dict(
+            count = reader.count, start_time = reader.start_time, end_time = reader.end_time,
+            heads = reader.heads, activities = reader.currentActivity, departures = reader.departures,
+            legcount = reader.legcount, activitycount = reader.activitycount, fixstart = reader.fixstart, unmatched_departures = reader.unmatched_departures)
+
+    if 'entered_link' in sinks:
+        result['entered_link'] = dict(count = dispatcher.readers['entered_link'].count)
+
+    if 'link_times' in sinks:
+        reader = dispatcher.readers['link_times']
+        result['link_times'] = dict(count = reader.count, inconsistent = reader.inconsistent, heads = reader.heads, vehicles = reader.vehicles)
+
+    return result
+
+def copy_rows(cursor, table, start, end = None):
+    """ Copies the rows after the first start rows of a shard table (up to row end), in the order the shard wrote them. """
+    if end is None:
+        cursor.execute('insert into _%s select * from shard._%s where rowid > ? order by rowid' % (table, table), (start,))
+    elif end > start:
+        cursor.execute('insert into _%s select * from shard._%s where rowid > ? and rowid <= ? order by rowid' % (table, table), (start, end))
+
+def merge(connection, results, sinks, batch_size = DEFAULT_BATCH_SIZE):
+    """
+        Merges the shard databases into the temporary tables of the connection, in shard order.
+
+        Rows that do not depend on other shards are copied with their event ids shifted by the number
+        of events in the preceding shards. Activities, legs and link times pair events that may lie in
+        different shards, so each shard reports
+          - heads: the events whose outcome depends on the state at the start of the shard
+            (per person the first activity event and the arrivals before its first departure,
+            per vehicle the link events up to its first 'left link'), and
+          - tails: the open activities, departures and vehicles at the end of the shard.
+        The heads are replayed here through regular readers that hold the state carried over from the
+        previous shards. Afterwards the state of every person or vehicle the shard resolved is replaced
+        by the tails of the shard. Activities without a start get the overall start time, and whatever
+        is still open after the last shard is closed like at the end of a sequential run.
+
+        Legs and link times are written in the order of their arrival or 'left link' events, like a
+        sequential run: the rows the shard paired itself are copied up to the position of each replayed
+        head before the row paired by the head is written.
+    """
+    cursor = connection.cursor()
+
+    events_reader = read_events.EventsReader(cursor, batch_size) if 'events' in sinks else None
+    link_times_reader = read_link_times.LinkEventsReader(cursor, batch_size) if 'link_times' in sinks else None
+
+    if events_reader is not None:
+        events_reader.start_time = min([result['events']['start_time'] for result in results if result['events']['start_time'] is not None], default = None)
+        events_reader.end_time = max([result['events']['end_time'] for result in results if result['events']['end_time'] is not None], default = None)
+
+    offsets = { 'events' : 0, 'entered_link' : 0 }
+    statistics = { 'legcount' : 0, 'activitycount' : 0, 'fixstart' : 0, 'unmatched_departures' : 0, 'link_times' : 0, 'inconsistent' : [0, 0, 0] }
+
+    for index, result in enumerate(results):
+        print('   Merging shard %d/%d ...' % (index + 1, len(results)))
+
+        cursor.execute('attach database ? as shard', (result['database'],))
+
+        if events_reader is not None:
+            events, offset = result['events'], offsets['events']
+
+            cursor.execute('insert into _events select event_id + ?, time, type, person, link, actType, vehicle, legMode from shard._events', (offset,))
+            cursor.execute('''
+                insert into _activities (person, start_id, end_id, start_time, end_time, link, act_type)
+                select person, start_id + ?, end_id + ?, coalesce(start_time, ?), end_time, link, act_type from shard._activities''',
+                (offset, offset, events_reader.start_time))
+
+            copied = 0
+
+            for head in events['heads']:
+                kind, person = head[:2]
+
+                if kind == 'departure' or kind == 'arrival':
+                    attributes = { 'person' : person, 'time' : head[2], 'legMode' : head[3], 'link' : head[4] }
+
+                    if head[5] > copied:
+                        events_reader.legs.flush()
+                        copy_rows(cursor, 'legs', copied, head[5])
+                        copied = head[5]
+
+                    getattr(events_reader, kind)(attributes)
+                    if kind == 'departure': events_reader.departures.pop(person, None)
+                else:
+                    event_id, etime, link, act_type = head[2:]
+                    attributes = { 'person' : person, 'link' : link, 'actType' : act_type }
+
+                    if kind == 'actend':
+                        events_reader.activity_end(event_id + offset, etime, attributes)
+
+                    events_reader.currentActivity.pop(person, None)
+
+            events_reader.legs.flush()
+            copy_rows(cursor, 'legs', copied)
+
+            for person, activity in events['activities'].items():
+                start_id, start_time, link, act_type = activity
+                events_reader.currentActivity[person] = (start_id + offset, start_time, link, act_type)
+
+            events_reader.departures.update(events['departures'])
+
+            for key in ('legcount', 'activitycount', 'fixstart', 'unmatched_departures'):
+                statistics[key] += events[key]
+
+            offsets['events'] += events['count']
+
+        if 'entered_link' in sinks:
+            cursor.execute('insert into _entered_link select event_id + ?, time, type, link, vehicle, legMode from shard._entered_link', (offsets['entered_link'],))
+            offsets['entered_link'] += result['entered_link']['count']
+
+        if link_times_reader is not None:
+            link_times = result['link_times']
+
+            copied = 0
+
+            for type, timestamp, vehicle, link, position in link_times['heads']:
+                if position > copied:
+                    link_times_reader.flush()
+                    copy_rows(cursor, 'linktimes', copied, position)
+                    copied = position
+
+                link_times_reader.startElement('event', { 'type' : type, 'time' : timestamp, 'vehicle' : vehicle, 'link' : link })
+
+            link_times_reader.flush()
+            copy_rows(cursor, 'linktimes', copied)
+
+            link_times_reader.vehicles.update(link_times['vehicles'])
+
+            statistics['link_times'] += link_times['count']
+            statistics['inconsistent'] = [a + b for a, b in zip(statistics['inconsistent'], link_times['inconsistent'])]
+
+        connection.commit()
+        cursor.execute('detach database shard')
+
+    if events_reader is not None:
+        events_reader.endDocument()
+
+        for key in ('legcount', 'activitycount', 'fixstart', 'unmatched_departures'):
+            statistics[key] += getattr(events_reader, key)
+
+        statistics['fixend'] = events_reader.fixend
+        statistics['start_time'] = events_reader.start_time
+        statistics['end_time'] = events_reader.end_time
+
+        # Activities were written shard by shard; number them like a sequential run, in the order of their end events and then of the starts of those still open
+        cursor.execute('create table _activities_merged as select * from _activities where 0')
+        cursor.execute('''
+            insert into _activities_merged (person, start_id, end_id, start_time, end_time, link, act_type)
+            select person, start_id, end_id, start_time, end_time, link, act_type from _activities
+            order by end_id is null, end_id, start_id''')
+        cursor.execute('delete from _activities')
+        cursor.execute('insert into _activities select * from _activities_merged')
+        cursor.execute('drop table _activities_merged')
+
+    if link_times_reader is not None:
+        link_times_reader.endDocument()
+        statistics['link_times'] += link_times_reader.count
+        statistics['inconsistent'] = [a + b for a, b in zip(statistics['inconsistent'], link_times_reader.inconsistent)]
+
+    connection.commit()
+
+    statistics['events'] = offsets['events']
+    statistics['entered_link'] = offsets['entered_link']
+    return statistics
+
+if __name__ == '__main__':
+    batch_size = options.pop_option(sys.argv, '--batch-size', DEFAULT_BATCH_SIZE, int)
+    parser = options.pop_option(sys.argv, '--parser', engine.DEFAULT_BACKEND)
+    profile = options.pop_option(sys.argv, '--profile', database.DEFAULT_PROFILE)
+    shards = options.pop_option(sys.argv, '--shards', os.cpu_count() or 1, int)
+    sinks = options.pop_option(sys.argv, '--sinks', ','.join(ingest_events.SINKS)).split(',')
+
+    if len(sys.argv) < 4:
+        print('shard_events.py source_xml database suffix [--shards N] [--sinks %s] [--batch-size N] [--parser %s] [--profile %s]' % (','.join(ingest_events.SINKS), '|'.join(engine.BACKENDS), '|'.join(database.PROFILES)))
+        exit()
+
+    source = pathlib.Path(sys.argv[1]).resolve()
+    destination = pathlib.Path(sys.argv[2])
+    suffix = sys.argv[3]
+
+    blocks = None
+
+    if str(source).endswith('.gz'):
+        blocks = bgzf_blocks(str(source))
+
+        if blocks is None:
+            print('Sharded ingest needs an uncompressed or BGZF compressed events file (e.g. recompress with bgzip)')
+            exit()
+
+        size = blocks[-1][1]
+    else:
+        size = source.stat().st_size
+
+    print('Ingesting events in %d shards from:' % shards)
+    print('    %s' % source)
+    print('')
+
+    print('Will write %s to:' % ', '.join(sinks))
+    print('    %s' % destination)
+    print('')
+
+    directory = pathlib.Path('%s.shards' % destination)
+    directory.mkdir(exist_ok = True)
+
+    start = time.time()
+    bounds = [size * index // shards for index in range(shards + 1)]
+
+    # The shard databases are removed even if a worker or the merge fails
+    try:
+        with concurrent.futures.ProcessPoolExecutor(shards) as executor:
+            futures = [
+                executor.submit(ingest_shard, str(source), bounds[index], bounds[index + 1], blocks, str(directory / ('shard_%d.db' % index)), sinks, batch_size, parser)
+                for index in range(shards)]
+
+            results = [future.result() for future in futures]
+
+        print('Parsed %d events in %.1fs\n' % (sum([result['count'] for result in results]), time.time() - start))
+
+        connection = database.connect(str(destination), profile)
+        cursor = connection.cursor()
+
+        ingest_events.create_tables(cursor, sinks, suffix)
+        statistics = merge(connection, results, sinks, batch_size)
+    finally:
+        shutil.rmtree(str(directory), ignore_errors = True)
+
+    if 'events' in sinks:
+        print('\nRead %d events' % statistics['events'])
+        print('Read %d activities (fixed %d start times, %d end times)' % (statistics['activitycount'], statistics['fixstart'], statistics['fixend']))
+        print('Paired %d legs (%d departures without arrival)' % (statistics['legcount'], statistics['unmatched_departures']))
+
+    if 'entered_link' in sinks:
+        print('Read %d entered link events' % statistics['entered_link'])
+
+    if 'link_times' in sinks:
+        print('Read %d link times (inconsistencies: %s)' % (statistics['link_times'], statistics['inconsistent']))
+
+    ingest_events.rename_tables(cursor, sinks, suffix)
+
+    connection.commit()
+    database.analyze(connection, ingest_events.table_names(sinks, suffix), profile)
+    connection.close()
+
+    print('\nFinished in %.1fs\n' % (time.time() - start))
@@ -0,0 +1,75 @@
+import math
+
+# The R*Tree holds the bounding box of each link (id = rowid of links) and its end points as auxiliary columns
+RTREE_FIELDS = ('id', 'min_x', 'max_x', 'min_y', 'max_y', '+from_x', '+from_y', '+to_x', '+to_y')
+
+def create_index(cursor, table = '_links_rtree'):
+    cursor.execute('drop table if exists %s' % table)
+    cursor.execute('create virtual table %s using rtree(%s)' % (table, ', '.join(RTREE_FIELDS)))
+
+def make_insert_query(table = '_links_rtree'):
+    fields = [field.lstrip('+') for field in RTREE_FIELDS]
+    return 'insert into %s (%s) values (%s)' % (table, ', '.join(fields), ', '.join(['?'] * len(fields)))
+
+def segment_distance(x, y, from_x, from_y, to_x, to_y):
+    """ Distance of a point to the straight line segment of a link. """
+    dx, dy = to_x - from_x, to_y - from_y
+    squared_length = dx * dx + dy * dy
+
+    if squared_length == 0.0:
+        return math.hypot(x - from_x, y - from_y)
+
+    t = max(0.0, min(1.0, ((x - from_x) * dx + (y - from_y) * dy) / squared_length))
+    return math.hypot(x - (from_x + t * dx), y - (from_y + t * dy))
+
+class NetworkIndex:
+    """ Nearest link and bounding box queries on a database written by read_network.py, backed by links_rtree. """
+
+    def __init__(self, connection):
+        self.cursor = connection.cursor()
+
+        self.cursor.execute('select min(min_x), max(max_x), min(min_y), max(max_y) from links_rtree')
+        self.extent = self.cursor.fetchone()
+
+    def query(self, min_x, min_y, max_x, max_y):
+        """ Returns (link id, from_x, from_y, to_x, to_y) of the links whose bounding box intersects the given one. """
+        self.cursor.execute('''
+            select links.id, r.from_x, r.from_y, r.to_x, r.to_y from links_rtree r join links on links.rowid = r.id
+            where r.max_x >= ? and r.min_x <= ? and r.max_y >= ? and r.min_y <= ?''', (min_x, max_x, min_y, max_y))
+
+        return self.cursor.fetchall()
+
+    def bbox(self, min_x, min_y, max_x, max_y, contained = False):
+        """ Returns the ids of the links that intersect the box, or only those that lie completely inside it. """
+        links = []
+
+        for link, from_x, from_y, to_x, to_y in self.query(min_x, min_y, max_x, max_y):
+            if contained and not (
+                min_x <= from_x <= max_x and min_x <= to_x <= max_x and
+                min_y <= from_y <= max_y and min_y <= to_y <= max_y): continue
+
+            links.append(link)
+
+        return links
+
+    def nearest(self, x, y, radius = 100.0):
+        """ Returns (link id, distance) of the link closest to the point, searching in growing squares around it. """
+        min_x, max_x, min_y, max_y = self.extent
+        if min_x is None: return None
+
+        # Once the square covers the whole network, every link has been considered
+        reach = math.hypot(max(abs(x - min_x), abs(x - max_x)), max(abs(y - min_y), abs(y - max_y)))
+        best = None
+
+        while True:
+            for link, from_x, from_y, to_x, to_y in self.query(x - radius, y - radius, x + radius, y + radius):
+                distance = segment_distance(x, y, from_x, from_y, to_x, to_y)
+
+                if best is None or distance < best[1]:
+                    best = (link, distance)
+
+            # Links closer than the radius intersect the square, so nothing outside can be closer
+            if best is not None and best[1] <= radius: return best
+            if radius >= reach: return best
+
+            radius *= 4.0
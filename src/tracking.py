@@ -0,0 +1,95 @@
+import array
+
+import intern
+
+class VehicleTable:
+    """
+        The link and enter time of the vehicles currently on a link. Vehicle ids are interned to integers
+        (in memory, see intern.LocalInterner) that index parallel arrays of the link index (-1 while the
+        vehicle is not on a link) and the enter time as float, so a vehicle that leaves just marks its entry.
+        Besides the interned id of each vehicle seen there are no per-vehicle objects for the garbage collector.
+    """
+
+    def __init__(self):
+        self.vehicle_ids = intern.LocalInterner()
+        self.count = 0
+
+        self.links = array.array('l')
+        self.times = array.array('d')
+
+        self.link_indices = {}
+        self.link_names = []
+
+    def link_index(self, link):
+        index = self.link_indices.get(link)
+
+        if index is None:
+            index = len(self.link_names)
+            self.link_indices[link] = index
+            self.link_names.append(link)
+
+        return index
+
+    def slot(self, vehicle):
+        """ Position of a vehicle in the arrays, or -1 if it was never seen. """
+        id = self.vehicle_ids.ids.get(vehicle)
+        return -1 if id is None else id - 1
+
+    def add(self, vehicle, link, time):
+        """ Stores the link of a vehicle unless it is already on one, returns whether it was added. """
+        slot = self.vehicle_ids(vehicle) - 1
+
+        if slot == len(self.links):
+            self.links.append(-1)
+            self.times.append(0.0)
+        elif self.links[slot] >= 0:
+            return False
+
+        index = self.link_indices.get(link)
+        if index is None: index = self.link_index(link)
+
+        self.links[slot] = index
+        self.times[slot] = float(time)
+        self.count += 1
+        return True
+
+    def pop(self, vehicle):
+        """ Removes a vehicle and returns its (link, enter time), or None if it is not on a link. """
+        slot = self.slot(vehicle)
+        if slot < 0 or self.links[slot] < 0: return None
+
+        index = self.links[slot]
+        self.links[slot] = -1
+        self.count -= 1
+        return self.link_names[index], self.times[slot]
+
+    def __contains__(self, vehicle):
+        slot = self.slot(vehicle)
+        return slot >= 0 and self.links[slot] >= 0
+
+    def __getitem__(self, vehicle):
+        if not vehicle in self: raise KeyError(vehicle)
+
+        slot = self.slot(vehicle)
+        return self.link_names[self.links[slot]], self.times[slot]
+
+    def __setitem__(self, vehicle, value):
+        self.pop(vehicle)
+        self.add(vehicle, *value)
+
+    def __delitem__(self, vehicle):
+        if self.pop(vehicle) is None: raise KeyError(vehicle)
+
+    def __len__(self):
+        return self.count
+
+    def items(self):
+        for vehicle, id in self.vehicle_ids.ids.items():
+            index = self.links[id - 1]
+
+            if index >= 0:
+                yield vehicle, (self.link_names[index], self.times[id - 1])
+
+    def update(self, other):
+        for vehicle, value in other.items():
+            self[vehicle] = value
@@ -0,0 +1,162 @@
+import os, time
+import struct, select
+import ctypes, ctypes.util
+
+# From <sys/inotify.h>
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_Q_OVERFLOW = 0x00004000
+IN_ISDIR = 0x40000000
+IN_CLOEXEC = os.O_CLOEXEC
+
+EVENT_HEADER = struct.Struct('iIII')
+
+DEFAULT_INTERVAL = 5.0
+
+def scan(directory):
+    """ Returns path -> (size, mtime) of all files below the directory. """
+    files = {}
+
+    for root, directories, names in os.walk(directory):
+        for name in names:
+            path = os.path.join(root, name)
+
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+
+            files[path] = (stat.st_size, stat.st_mtime)
+
+    return files
+
+class PollingWatcher:
+    """
+        Reports the files below a directory that are new or changed, by scanning it every interval.
+        A file is only reported once its size and mtime are the same in two scans in a row, so that
+        files which are still being written are not read half way.
+    """
+
+    def __init__(self, directory, interval = DEFAULT_INTERVAL):
+        self.directory = str(directory)
+        self.interval = interval
+
+        self.pending = {}
+        self.reported = {}
+        self.last_scan = None
+
+    def poll(self):
+        """ Waits for the next scan and returns the files that settled since the last one. """
+        if self.last_scan is not None:
+            time.sleep(max(0.0, self.last_scan + self.interval - time.time()))
+
+        self.last_scan = time.time()
+        files = scan(self.directory)
+        settled = []
+
+        for path, stat in files.items():
+            if self.reported.get(path) == stat: continue
+
+            if self.pending.get(path) == stat:
+                self.reported[path] = stat
+                settled.append(path)
+
+        self.pending = files
+        return sorted(settled)
+
+    def close(self):
+        pass
+
+class InotifyWatcher:
+    """
+        Reports the files below a directory that were closed after writing or moved into it, using
+        inotify through ctypes. Directories created later (e.g. ITERS/it.N) are watched as they appear.
+        The first poll reports the files that already exist.
+    """
+
+    MASK = IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+
+    def __init__(self, directory, interval = DEFAULT_INTERVAL):
+        self.directory = str(directory)
+        self.interval = interval
+
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno = True)
+        self.add_watch = libc.inotify_add_watch
+        self.add_watch.argtypes = (ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32)
+
+        self.fd = libc.inotify_init1(IN_CLOEXEC)
+
+        if self.fd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno))
+
+        self.directories = {}
+        self.initial = self.watch_tree(self.directory)
+
+    def watch(self, directory):
+        descriptor = self.add_watch(self.fd, os.fsencode(directory), self.MASK)
+
+        if descriptor < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno), directory)
+
+        self.directories[descriptor] = directory
+
+    def watch_tree(self, directory):
+        """ Watches a directory and everything below it, returns the files already in there. """
+        files = []
+
+        for root, directories, names in os.walk(directory):
+            self.watch(root)
+            files += [os.path.join(root, name) for name in names]
+
+        return files
+
+    def poll(self):
+        """ Waits for files to be written (at most one interval) and returns them. """
+        if self.initial is not None:
+            files, self.initial = self.initial, None
+            return sorted(files)
+
+        readable, _, _ = select.select([self.fd], [], [], self.interval)
+        if len(readable) == 0: return []
+
+        data = os.read(self.fd, 1 << 16)
+        files = []
+        offset = 0
+
+        while offset < len(data):
+            descriptor, mask, cookie, length = EVENT_HEADER.unpack_from(data, offset)
+            name = os.fsdecode(data[offset + EVENT_HEADER.size:offset + EVENT_HEADER.size + length].rstrip(b'\0'))
+            offset += EVENT_HEADER.size + length
+
+            if mask & IN_Q_OVERFLOW:
+                # Events were lost, so everything is reported again
+                files += list(scan(self.directory))
+                continue
+
+            if not descriptor in self.directories: continue
+            path = os.path.join(self.directories[descriptor], name)
+
+            if mask & IN_ISDIR:
+                # Files may have been written before the watch was added
+                if mask & (IN_CREATE | IN_MOVED_TO):
+                    files += self.watch_tree(path)
+            elif mask & (IN_CLOSE_WRITE | IN_MOVED_TO):
+                files.append(path)
+
+        return sorted(set(files))
+
+    def close(self):
+        os.close(self.fd)
+
+def watcher(directory, interval = DEFAULT_INTERVAL, polling = False):
+    """ An inotify watcher where available, polling otherwise. """
+    if not polling:
+        try:
+            return InotifyWatcher(directory, interval)
+        except (OSError, AttributeError, TypeError):
+            pass
+
+    return PollingWatcher(directory, interval)
@@ -0,0 +1,132 @@
+import gzip
+import pathlib
+import sys, os, re
+
+import options
+import engine, database, watch
+import read_events, read_relaxation
+from writer import DEFAULT_BATCH_SIZE, make_insert_query
+
+HISTOGRAM = re.compile(r'^ITERS/it\.(\d+)/\1\.legHistogram\.txt$')
+EVENTS = re.compile(r'^ITERS/it\.(\d+)/\1\.events\.xml\.gz$')
+
+def create_tables(cursor, modes):
+    """ Creates the relaxation table (or checks that an existing one has the same modes) and the table of ingested files. """
+    fields = list(read_relaxation.FIELDS) + modes
+
+    cursor.execute('create table if not exists relaxation (iteration integer primary key, size integer, mtime real, %s)' % ', '.join(['%s integer' % mode for mode in modes]))
+    cursor.execute('pragma table_info(relaxation)')
+
+    if [row[1] for row in cursor.fetchall()] != fields:
+        raise RuntimeError('The relaxation table of this database was written for other modes')
+
+    cursor.execute('create table if not exists _watched (path text primary key, size integer, mtime real)')
+
+def is_ingested(cursor, path, stat):
+    cursor.execute('select size, mtime from _watched where path = ?', (path,))
+    return cursor.fetchone() == (stat.st_size, stat.st_mtime)
+
+def ingest_histogram(cursor, path, stat, iteration, modes):
+    shares = read_relaxation.read_histogram(path, modes)
+
+    query = make_insert_query('relaxation', list(read_relaxation.FIELDS) + modes).replace('insert', 'insert or replace', 1)
+    cursor.execute(query, [iteration, stat.st_size, stat.st_mtime] + shares)
+
+    print('   Iteration %d: %s' % (iteration, ', '.join(['%s %d' % item for item in zip(modes, shares)])))
+
+def ingest_events(connection, path, iteration, batch_size, parser):
+    """ Reads the events of an iteration into events_N, activities_N and legs_N, replacing earlier ones. """
+    cursor = connection.cursor()
+    read_events.create_tables(cursor)
+
+    reader = read_events.EventsReader(cursor, batch_size)
+
+    with gzip.open(path) as f:
+        engine.parse(f, reader, parser)
+
+    for table, fields, types in read_events.EventsReader.TABLES:
+        cursor.execute('drop table if exists %s_%d' % (table, iteration))
+
+    read_events.rename_tables(cursor, str(iteration))
+
+    print('   Iteration %d: %d events, %d activities, %d legs' % (iteration, reader.count, reader.activitycount, reader.legcount))
+
+def ingest(connection, source, path, modes, events, batch_size, parser):
+    """ Reads a legHistogram (or events file) unless it was already read with the same size and mtime. """
+    cursor = connection.cursor()
+    relative = pathlib.Path(path).relative_to(source).as_posix()
+
+    histogram = HISTOGRAM.match(relative)
+    events_file = EVENTS.match(relative) if events else None
+    if histogram is None and events_file is None: return
+
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return
+
+    if is_ingested(cursor, relative, stat): return
+
+    try:
+        if histogram is not None:
+            ingest_histogram(cursor, path, stat, int(histogram.group(1)), modes)
+        else:
+            ingest_events(connection, path, int(events_file.group(1)), batch_size, parser)
+    except Exception as error:
+        # Most likely still being written, it is read again once it changes
+        connection.rollback()
+        print('   Could not read %s yet: %s' % (relative, error))
+        return
+
+    cursor.execute('insert or replace into _watched (path, size, mtime) values (?,?,?)', (relative, stat.st_size, stat.st_mtime))
+    connection.commit()
+
+if __name__ == '__main__':
+    batch_size = options.pop_option(sys.argv, '--batch-size', DEFAULT_BATCH_SIZE, int)
+    parser = options.pop_option(sys.argv, '--parser', engine.DEFAULT_BACKEND)
+    profile = options.pop_option(sys.argv, '--profile', 'wal')
+    interval = options.pop_option(sys.argv, '--interval', watch.DEFAULT_INTERVAL, float)
+    polling = options.pop_flag(sys.argv, '--poll')
+    events = options.pop_flag(sys.argv, '--events')
+    once = options.pop_flag(sys.argv, '--once')
+
+    if len(sys.argv) < 3:
+        print('watch_output.py matsim_output_path database [modes] [--events] [--poll] [--interval seconds] [--once] [--batch-size N] [--parser %s] [--profile %s]' % ('|'.join(engine.BACKENDS), '|'.join(database.PROFILES)))
+        exit()
+
+    source = pathlib.Path(sys.argv[1]).resolve()
+    destination = sys.argv[2]
+
+    modes = sys.argv[3].split(',') if len(sys.argv) > 3 else ['av', 'car', 'pt']
+
+    connection = database.connect(str(destination), profile)
+    cursor = connection.cursor()
+
+    try:
+        create_tables(cursor, modes)
+    except RuntimeError as error:
+        print(error)
+        exit()
+
+    connection.commit()
+
+    if once:
+        print('Reading %s ...\n' % source)
+
+        for path in sorted(watch.scan(str(source))):
+            ingest(connection, source, path, modes, events, batch_size, parser)
+    else:
+        watcher = watch.watcher(source, interval, polling)
+        print('Watching %s (%s, stop with Ctrl+C) ...\n' % (source, 'inotify' if isinstance(watcher, watch.InotifyWatcher) else 'polling every %.1fs' % interval))
+
+        try:
+            while True:
+                for path in watcher.poll():
+                    ingest(connection, source, path, modes, events, batch_size, parser)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            watcher.close()
+
+    connection.close()
+    print('\nDone.')
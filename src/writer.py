@@ -0,0 +1,41 @@
+import convert
+
+DEFAULT_BATCH_SIZE = 10000
+
+class BufferedWriter:
+    """
+        Collects rows for one insert query and writes them in batches with executemany.
+        Optional per-column converters (None for columns that are kept) are compiled into one
+        row function and applied when flushing.
+    """
+
+    def __init__(self, cursor, query, batch_size = DEFAULT_BATCH_SIZE, converters = None):
+        self.cursor = cursor
+        self.query = query
+        self.batch_size = max(1, batch_size)
+
+        self.convert = convert.compile_row(converters)
+
+        self.rows = []
+        self.count = 0
+
+    def append(self, row):
+        self.rows.append(row)
+
+        if len(self.rows) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if len(self.rows) > 0:
+            if self.convert is not None:
+                self.rows = list(map(self.convert, self.rows))
+
+            self.cursor.executemany(self.query, self.rows)
+            self.count += len(self.rows)
+            self.rows = []
+
+def make_insert_query(table, fields):
+    return 'insert into %s (%s) values (%s)' % (table, ', '.join(fields), ', '.join(['?'] * len(fields)))
+
+def make_create_query(table, fields, types):
+    return 'create table %s (%s)' % (table, ', '.join(['%s %s' % (field, type) for field, type in zip(fields, types)]))
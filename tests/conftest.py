@@ -0,0 +1,4 @@
+import sys, pathlib
+
+# The scripts in src import each other as top level modules
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent.parent / 'src'))
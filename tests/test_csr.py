@@ -0,0 +1,71 @@
+import gzip
+import sqlite3
+
+import numpy as np
+import pytest
+
+import engine, csr
+from read_network import NetworkReader, create_tables
+
+# a -> b is curved: its length attribute is longer than the 5 between the nodes, b -> c has no length attribute
+NETWORK = b'''<?xml version="1.0" encoding="utf-8"?>
+<network>
+    <nodes>
+        <node id="a" x="0.0" y="0.0" />
+        <node id="b" x="3.0" y="4.0" />
+        <node id="c" x="6.0" y="0.0" />
+    </nodes>
+    <links>
+        <link id="ab" from="a" to="b" length="12.5" />
+        <link id="bc" from="b" to="c" />
+        <link id="ac" from="a" to="c" length="20.0" />
+    </links>
+</network>
+'''
+
+def read_network(tmp_path):
+    path = tmp_path / 'network.xml.gz'
+
+    with gzip.open(str(path), 'wb') as f:
+        f.write(NETWORK)
+
+    connection = sqlite3.connect(':memory:')
+    cursor = connection.cursor()
+    create_tables(cursor)
+
+    reader = NetworkReader(cursor, adjacency = True)
+
+    with gzip.open(str(path)) as f:
+        engine.parse(f, reader)
+
+    return cursor, reader.graph()
+
+def test_lengths_from_attribute(tmp_path):
+    cursor, graph = read_network(tmp_path)
+
+    cursor.execute('select id, length from _links order by rowid')
+    assert cursor.fetchall() == [('ab', 12.5), ('bc', 5.0), ('ac', 20.0)]
+
+    assert list(graph.offsets) == [0, 2, 3, 3]
+    assert list(graph.targets) == [1, 2, 2]
+    assert list(graph.links) == [0, 2, 1]
+    assert list(graph.lengths) == [12.5, 20.0, 5.0]
+
+def test_shortest_paths_use_attribute(tmp_path):
+    pytest.importorskip('scipy')
+    import scipy.sparse.csgraph
+
+    cursor, graph = read_network(tmp_path)
+    distances = scipy.sparse.csgraph.dijkstra(graph.matrix(), indices = 0)
+
+    # With the chord of a -> b (5), going through b (10) would be shorter than the direct link
+    assert distances[1] == 12.5
+    assert distances[2] == 17.5
+
+def test_save_load(tmp_path):
+    cursor, graph = read_network(tmp_path)
+    csr.save(tmp_path / 'csr', graph)
+    loaded = csr.load(tmp_path / 'csr')
+
+    for name in csr.ARRAYS:
+        assert np.array_equal(getattr(graph, name), getattr(loaded, name))
@@ -0,0 +1,72 @@
+import random
+import sqlite3
+
+import pytest
+
+import engine, ingest_events
+from shard_events import ingest_shard, merge
+
+TABLES = ('_events', '_activities', '_legs', '_linktimes', '_entered_link')
+
+def write_events(path, count = 4000, persons = 30, seed = 0):
+    """ Random events of few persons, with repeated starts, unmatched arrivals and open activities at the end. """
+    rng = random.Random(seed)
+    timestamp = 0.0
+
+    with open(str(path), 'w') as f:
+        f.write('<?xml version="1.0" encoding="utf-8"?>\n<events version="1.0">\n')
+
+        for index in range(count):
+            timestamp += rng.randrange(3)
+            person, link = rng.randrange(persons), rng.randrange(5)
+            type = rng.choice(['actstart', 'actend', 'departure', 'arrival', 'entered link', 'left link'])
+
+            if type in ('entered link', 'left link'):
+                f.write('\t<event time="%.1f" type="%s" vehicle="%d" link="%d" legMode="car" />\n' % (timestamp, type, person, link))
+            elif type in ('departure', 'arrival'):
+                f.write('\t<event time="%.1f" type="%s" person="%d" link="%d" legMode="%s" />\n' % (timestamp, type, person, link, rng.choice(['car', 'pt'])))
+            else:
+                f.write('\t<event time="%.1f" type="%s" person="%d" link="%d" actType="home" />\n' % (timestamp, type, person, link))
+
+        f.write('</events>\n')
+
+def read_tables(connection):
+    return { table : connection.execute('select * from %s order by rowid' % table).fetchall() for table in TABLES }
+
+@pytest.fixture(scope = 'module')
+def events(tmp_path_factory):
+    path = tmp_path_factory.mktemp('events') / 'events.xml'
+    write_events(path)
+
+    connection = sqlite3.connect(':memory:')
+    cursor = connection.cursor()
+    ingest_events.create_tables(cursor, ingest_events.SINKS, 'test')
+
+    dispatcher = ingest_events.make_dispatcher(cursor, ingest_events.SINKS)
+
+    with open(str(path), 'rb') as f:
+        engine.parse(f, dispatcher)
+
+    return path, read_tables(connection)
+
+@pytest.mark.parametrize('shards', [1, 3, 7, 40])
+def test_merge_matches_sequential(events, tmp_path, shards):
+    path, expected = events
+    size = path.stat().st_size
+    bounds = [size * index // shards for index in range(shards + 1)]
+
+    results = [
+        ingest_shard(str(path), bounds[index], bounds[index + 1], None, str(tmp_path / ('shard_%d.db' % index)), ingest_events.SINKS, 100, engine.DEFAULT_BACKEND)
+        for index in range(shards)]
+
+    connection = sqlite3.connect(':memory:')
+    ingest_events.create_tables(connection.cursor(), ingest_events.SINKS, 'test')
+    merge(connection, results, ingest_events.SINKS, 100)
+
+    actual = read_tables(connection)
+
+    for table in TABLES:
+        assert actual[table] == expected[table], table
+
+    # Activities still open at the end of the file are compared as well
+    assert any(row[3] is None for row in actual['_activities'])